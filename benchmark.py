@@ -0,0 +1,266 @@
+"""舔狗日记插件离线基准测试。
+
+不连接真实的 LLM 和消息平台：用桩 Context、可配置延迟/失败率的假 LLM 提供商和假消息发送器驱动插件，
+在不同的历史日记规模和群组数量下测量各指令的耗时（p50/p99）、LLM 调用次数、写入字节数和峰值内存。
+
+需要在装有 AstrBot 的环境中运行（插件依赖 astrbot 包），所有数据写入临时目录，不会影响真实数据：
+
+    python data/plugins/astrbot_plugin_dogdiary/benchmark.py --sizes 10 1000 10000 --groups 1 100 1000
+"""
+
+import argparse
+import asyncio
+import json
+import logging
+import os
+import random
+import statistics
+import sys
+import tempfile
+import time
+import tracemalloc
+from datetime import date, timedelta
+from pathlib import Path
+from typing import Dict, List, Optional
+
+sys.path.insert(0, str(Path(__file__).resolve().parent))
+
+WORDS = ["下雨", "她", "微信", "奶茶", "电影", "加班", "失眠", "拉黑", "生日", "礼物",
+         "外卖", "地铁", "早安", "晚安", "朋友圈", "点赞", "心碎", "开心", "等待", "电话"]
+
+
+class FakeResponse:
+    def __init__(self, text: str):
+        self.role = "assistant"
+        self.completion_text = text
+
+
+class FakeProvider:
+    """模拟 LLM 提供商：按提示词类型返回日记、JSON、摘要或评分，可配置延迟和失败率。"""
+
+    def __init__(self, latency: float, jitter: float, failure_rate: float, rng: random.Random):
+        self.latency = latency
+        self.jitter = jitter
+        self.failure_rate = failure_rate
+        self.rng = rng
+        self.calls = 0
+        self.failures = 0
+
+    async def text_chat(self, prompt: str, contexts=None, func_tool=None, **kwargs):
+        self.calls += 1
+        await asyncio.sleep(max(0.0, self.latency + self.rng.uniform(-self.jitter, self.jitter)))
+        if self.rng.random() < self.failure_rate:
+            self.failures += 1
+            raise RuntimeError("fake provider failure")
+        if "关键情感" in prompt:
+            return FakeResponse("她没回消息，我很难过。")
+        diary = "。".join(f"今天{self.rng.choice(WORDS)}，我又想起了{self.rng.choice(WORDS)}" for _ in range(12))
+        if "JSON" in prompt:
+            return FakeResponse(json.dumps({"diary": diary, "emotion_score": self.rng.randint(1, 10)}, ensure_ascii=False))
+        if prompt.startswith("分析以下文本的情感强度"):
+            return FakeResponse(str(self.rng.randint(1, 10)))
+        return FakeResponse(diary)
+
+
+class FakeContext:
+    """桩 Context：提供假 LLM 提供商，send_message 模拟平台发送延迟和失败。"""
+
+    def __init__(self, provider: FakeProvider, send_latency: float, send_failure_rate: float, rng: random.Random):
+        self.provider = provider
+        self.send_latency = send_latency
+        self.send_failure_rate = send_failure_rate
+        self.rng = rng
+        self.sent = 0
+
+    def get_using_provider(self, *args, **kwargs):
+        return self.provider
+
+    async def send_message(self, umo: str, chain) -> bool:
+        await asyncio.sleep(self.send_latency)
+        if self.rng.random() < self.send_failure_rate:
+            raise RuntimeError("fake platform failure")
+        self.sent += 1
+        return True
+
+
+class FakeEvent:
+    def __init__(self, message_str: str, umo: str = "bench:GroupMessage:10000"):
+        self.message_str = message_str
+        self.unified_msg_origin = umo
+
+    def plain_result(self, text: str):
+        return text
+
+    def chain_result(self, chain):
+        return chain
+
+
+class Recorder:
+    """按操作名汇总耗时、LLM 调用次数和写入字节数。"""
+
+    def __init__(self, provider: FakeProvider):
+        self.provider = provider
+        self.samples: Dict[str, List[float]] = {}
+        self.llm_calls: Dict[str, int] = {}
+        self.bytes_written: Dict[str, int] = {}
+
+    async def measure(self, name: str, coro_factory):
+        calls, written = self.provider.calls, written_bytes()
+        started = time.perf_counter()
+        result = await coro_factory()
+        self.samples.setdefault(name, []).append((time.perf_counter() - started) * 1000)
+        self.llm_calls[name] = self.llm_calls.get(name, 0) + self.provider.calls - calls
+        if written is not None:
+            self.bytes_written[name] = self.bytes_written.get(name, 0) + written_bytes() - written
+        return result
+
+    def rows(self) -> List[str]:
+        rows = []
+        for name, samples in self.samples.items():
+            ordered = sorted(samples)
+            p50 = statistics.median(ordered)
+            p99 = ordered[min(len(ordered) - 1, int(len(ordered) * 0.99))]
+            written = self.bytes_written.get(name)
+            rows.append(f"  {name:<34} n={len(samples):<4} p50={p50:9.1f}ms  p99={p99:9.1f}ms  "
+                        f"llm={self.llm_calls[name]:<5} written={format_bytes(written)}")
+        return rows
+
+
+def written_bytes() -> Optional[int]:
+    # Linux 下读取本进程的写入字节数（含 write 系统调用写入的所有数据），其他平台返回 None
+    try:
+        with open("/proc/self/io", "r") as f:
+            for line in f:
+                if line.startswith("wchar:"):
+                    return int(line.split()[1])
+    except OSError:
+        return None
+    return None
+
+
+def format_bytes(value: Optional[int]) -> str:
+    if value is None:
+        return "n/a"
+    for unit in ("B", "KB", "MB"):
+        if value < 1024:
+            return f"{value:.0f}{unit}"
+        value /= 1024
+    return f"{value:.1f}GB"
+
+
+def seed_history(legacy_file: Path, size: int, rng: random.Random):
+    # 以旧版 dog_diaries.json 的形式写入历史日记，插件首次启动时会自动导入
+    today = date.today()
+    diaries = {}
+    for i in range(1, size + 1):
+        diary_date = today - timedelta(days=i)
+        score = rng.randint(1, 10)
+        diaries[diary_date.isoformat()] = {
+            "time": f"{diary_date.isoformat()} ☀️周{'日一二三四五六'[int(diary_date.strftime('%w'))]}",
+            "content": "。".join(f"今天{rng.choice(WORDS)}，我{rng.choice(WORDS)}了" for _ in range(15)),
+            "important": score >= 7,
+            "emotion_score": score,
+        }
+    legacy_file.parent.mkdir(parents=True, exist_ok=True)
+    with open(legacy_file, "w", encoding="utf-8") as f:
+        json.dump(diaries, f, ensure_ascii=False)
+
+
+async def drain(agen):
+    return [item async for item in agen]
+
+
+async def run_size(main, size: int, args, rng: random.Random) -> List[str]:
+    # 插件使用相对路径的数据目录：在临时目录中运行，结束后恢复工作目录并删除临时数据
+    cwd = os.getcwd()
+    with tempfile.TemporaryDirectory(prefix=f"dogdiary_bench_{size}_") as workdir:
+        os.chdir(workdir)
+        try:
+            return await run_in_workdir(main, size, args, rng)
+        finally:
+            os.chdir(cwd)
+
+
+async def run_in_workdir(main, size: int, args, rng: random.Random) -> List[str]:
+    seed_history(main.DIARY_JSON_FILE, size, rng)
+    provider = FakeProvider(args.latency, args.jitter, args.failure_rate, rng)
+    context = FakeContext(provider, args.send_latency, args.send_failure_rate, rng)
+    config = {
+        "dogdiary_auto_send_groups": [],
+        "dogdiary_send_concurrency": args.send_concurrency,
+        "dogdiary_send_rate": args.send_rate,
+        "dogdiary_send_retries": args.send_retries,
+    }
+    recorder = Recorder(provider)
+
+    async def create_plugin():
+        created = main.LickDogDiaryPlugin(context, config)
+        await created._ensure_ready()
+        return created
+
+    tracemalloc.start()
+    plugin = await recorder.measure("startup", create_plugin)
+    timeline = plugin.global_timeline
+    event = FakeEvent("今日舔狗日记")
+    try:
+        await recorder.measure("summarize_and_forget_diaries(cold)", lambda: plugin.summarize_and_forget_diaries(timeline))
+        for _ in range(args.iterations):
+            await recorder.measure("summarize_and_forget_diaries(warm)",
+                                   lambda: plugin.summarize_and_forget_diaries(timeline))
+        await recorder.measure("generate_diary(cold)", lambda: drain(plugin.generate_diary(event)))
+        for _ in range(args.iterations):
+            await recorder.measure("generate_diary(cached)", lambda: drain(plugin.generate_diary(event)))
+        for _ in range(args.iterations):
+            await recorder.measure("rewrite_diary", lambda: drain(plugin.rewrite_diary(FakeEvent("重写舔狗日记"))))
+        page_count = max(1, (len(timeline.store) + plugin.list_page_size - 1) // plugin.list_page_size)
+        for _ in range(args.iterations):
+            page = rng.randint(1, page_count)
+            await recorder.measure("list_diaries(page)", lambda: drain(plugin.list_diaries(FakeEvent(f"舔狗日记列表 {page}"))))
+        for groups in args.groups:
+            group_ids = [str(100000 + i) for i in range(groups)]
+            plugin.base_umo = "bench:GroupMessage:10000"
+            for _ in range(max(1, args.iterations // 4)):
+                plugin.sent_cache = {}
+                await recorder.measure(f"broadcast({groups} groups)", lambda: plugin._broadcast_today_diary(group_ids))
+        _, peak = tracemalloc.get_traced_memory()
+    finally:
+        tracemalloc.stop()
+        await plugin.terminate()
+
+    lines = [f"历史日记 {size} 篇（LLM 调用 {provider.calls} 次，失败 {provider.failures} 次；"
+             f"成功发送 {context.sent} 条；峰值内存 {format_bytes(peak)}）"]
+    lines.extend(recorder.rows())
+    return lines
+
+
+async def main_async(args):
+    import main
+    rng = random.Random(args.seed)
+    report = []
+    for size in args.sizes:
+        report.extend(await run_size(main, size, args, rng))
+    return report
+
+
+def parse_args(argv=None):
+    parser = argparse.ArgumentParser(description="舔狗日记插件离线基准测试")
+    parser.add_argument("--sizes", type=int, nargs="+", default=[10, 1000, 10000], help="历史日记篇数")
+    parser.add_argument("--groups", type=int, nargs="+", default=[1, 100, 1000], help="定时群发的群组数")
+    parser.add_argument("--iterations", type=int, default=20, help="每个操作的重复次数")
+    parser.add_argument("--latency", type=float, default=0.05, help="假 LLM 的平均延迟（秒）")
+    parser.add_argument("--jitter", type=float, default=0.02, help="假 LLM 延迟的随机抖动（秒）")
+    parser.add_argument("--failure-rate", type=float, default=0.0, help="假 LLM 的失败率")
+    parser.add_argument("--send-latency", type=float, default=0.01, help="假消息平台的发送延迟（秒）")
+    parser.add_argument("--send-failure-rate", type=float, default=0.0, help="假消息平台的发送失败率")
+    parser.add_argument("--send-concurrency", type=int, default=50, help="群发并发数")
+    parser.add_argument("--send-rate", type=float, default=1000.0, help="每平台发送速率（条/秒）")
+    parser.add_argument("--send-retries", type=int, default=0, help="发送失败重试次数")
+    parser.add_argument("--seed", type=int, default=0, help="随机种子")
+    return parser.parse_args(argv)
+
+
+if __name__ == "__main__":
+    # 插件日志写入 stderr 会计入写入字节数，基准测试期间关闭
+    logging.disable(logging.CRITICAL)
+    for line in asyncio.run(main_async(parse_args())):
+        print(line)
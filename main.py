@@ -4,8 +4,19 @@ import re
 import os
 from datetime import datetime, date, timedelta
 from pathlib import Path
-from typing import Dict, Any, List
+from typing import Dict, Any, List, Optional, Tuple
 import asyncio
+import bisect
+import contextlib
+import math
+import struct
+import threading
+import time
+import zlib
+try:
+    import numpy as np  # 可选依赖，用于向量化重建情感统计
+except ImportError:
+    np = None
 from astrbot.api.event import filter, AstrMessageEvent, MessageEventResult
 from astrbot.api.star import Context, Star, register
 from astrbot.core.config.astrbot_config import AstrBotConfig
@@ -13,94 +24,1458 @@ from astrbot.api.event import MessageChain
 import astrbot.api.message_components as Comp
 from astrbot.api import logger  # 使用 AstrBot 提供的 logger 接口
 
+DATA_DIR = Path("data/plugins_data/astrbot_plugin_dogdiary")
 DIARY_JSON_FILE = Path("data/plugins_data/astrbot_plugin_dogdiary") / "dog_diaries.json"
-SUMMARY_CACHE_FILE = Path("data/plugins_data/astrbot_plugin_dogdiary") / "summary_cache.json"
-ORIGINAL_BACKUP_DIR = Path("data/plugins_data/astrbot_plugin_dogdiary/originals")
 UMO_CACHE_FILE = Path("data/plugins_data/astrbot_plugin_dogdiary") / "umo_cache.json"
 SENT_CACHE_FILE = Path("data/plugins_data/astrbot_plugin_dogdiary") / "sent_cache.json"
+TIMELINES_DIR = Path("data/plugins_data/astrbot_plugin_dogdiary") / "timelines"
+SEARCH_RESULT_LIMIT = 10
+TIMELINE_OPEN_CONCURRENCY = 8
+BACKFILL_MAX_DAYS = 31
+STATS_RECENT_WEEKS = 8
+STATS_RECENT_MONTHS = 6
+STATS_TOP_ENTRIES = 5
+HISTORY_STATE_KEY = "history_state"
+HISTORY_NEXT_KEY = "history_next"
+HISTORY_WINDOW_DAYS = 30
+RECENT_FULL_TEXT_DAYS = 7
+SUMMARY_CACHE_MAX_ENTRIES = 64
+DELIVERY_LEDGER_DAYS = 7
+SCHEDULER_STATE_FILE = Path("data/plugins_data/astrbot_plugin_dogdiary") / "scheduler_state.json"
+METRICS_FILE = Path("data/plugins_data/astrbot_plugin_dogdiary") / "metrics.txt"
+SLOW_SPAN_MS = 1000
+FORWARD_NODE_MAX_CHARS = 1000
+STREAM_BREAK_MARKS = ("\n", "。", "！", "？", "!", "?", "…")
+STRUCTURED_OUTPUT_INSTRUCTION = (
+    "\n\n请严格按以下 JSON 格式返回，不要输出任何其他内容：\n"
+    '{"diary": "日记正文", "emotion_score": 日记的情感强度评分（1-10 的整数，1 表示情感极弱，10 表示情感极强）}'
+)
+
+
+class DiaryStore:
+    """追加写入的日记存储。
+
+    每条新增或重写的日记以一行 JSON 追加到日志文件末尾，内存中常驻按日期排序的日记视图和
+    日期 -> (偏移, 长度) 索引，读取不再访问磁盘；日志文件的 mtime/大小与上次写入不一致时
+    （例如被手动编辑）才会重新加载。同一日期被重写后旧记录成为垃圾，垃圾比例过高时通过 compact()
+    重写日志回收空间。首次启动时若日志不存在，会从旧版 dog_diaries.json 导入全部日记。
+
+    _lock 只保护内存视图，读取和发布写入结果时短暂持有；追加、fsync、重新加载和压缩由 _write_lock
+    串行化，磁盘 I/O 期间不持有 _lock，事件循环中的读取不会等待 fsync。外部修改在每次写入前和
+    refresh_if_changed() 中检测，重新加载应在工作线程中进行。
+    """
+
+    COMPACT_MIN_GARBAGE = 64
+    COMPACT_GARBAGE_RATIO = 0.5
+
+    def __init__(self, log_file: Path, legacy_file: Optional[Path] = None):
+        self.log_file = log_file
+        self.legacy_file = legacy_file
+        self._index: Dict[str, Tuple[int, int]] = {}
+        self._entries: Dict[str, Dict[str, Any]] = {}
+        self._dates: List[str] = []
+        self._garbage = 0
+        self._version = 0
+        self._stat: Tuple[int, int] = (0, 0)
+        self._lock = threading.RLock()
+        self._write_lock = threading.RLock()
+
+    def open(self):
+        with self._write_lock:
+            if not self.log_file.exists():
+                self.log_file.parent.mkdir(parents=True, exist_ok=True)
+                self._create_log()
+            elif self._legacy_pending() and not self.log_file.stat().st_size:
+                # 日志为空而旧版文件尚未导入（例如上次读取旧版文件失败）：重新尝试导入
+                self._create_log()
+            elif self._legacy_pending():
+                # 旧版本已导入过但没有留下标记：补上标记，之后删除日志重置时不会再次导入
+                self._legacy_marker().touch()
+            self._load()
+
+    def _legacy_marker(self) -> Path:
+        return self.legacy_file.with_name(self.legacy_file.name + ".imported")
+
+    def _legacy_pending(self) -> bool:
+        return bool(self.legacy_file) and self.legacy_file.exists() and not self._legacy_marker().exists()
+
+    def _create_log(self):
+        # 日志先完整写入临时文件并落盘，再原子替换到位：导入中途崩溃不会留下只含部分日记的日志，
+        # 下次启动会重新导入；导入完成后在旧版文件旁留下 .imported 标记，旧版文件本身保留不动
+        legacy = self._read_legacy() if self._legacy_pending() else {}
+        tmp_file = self.log_file.with_suffix(".log.tmp")
+        with open(tmp_file, 'wb') as f:
+            for diary_date in sorted(legacy):
+                f.write(self._encode(diary_date, legacy[diary_date]))
+            f.flush()
+            os.fsync(f.fileno())
+        os.replace(tmp_file, self.log_file)
+        if legacy:
+            self._legacy_marker().touch()
+            logger.info(f"已从 {self.legacy_file.name} 导入 {len(legacy)} 篇日记到追加日志")
+
+    def _read_legacy(self) -> Dict[str, Dict[str, Any]]:
+        try:
+            with open(self.legacy_file, 'r', encoding='utf-8') as f:
+                return json.load(f) or {}
+        except Exception as e:
+            logger.error(f"读取旧版日记文件时出错，跳过导入: {e}")
+            return {}
+
+    @staticmethod
+    def _encode(diary_date: str, entry: Dict[str, Any]) -> bytes:
+        return (json.dumps({"date": diary_date, "entry": entry}, ensure_ascii=False) + "\n").encode('utf-8')
+
+    def _file_stat(self) -> Tuple[int, int]:
+        st = self.log_file.stat()
+        return st.st_mtime_ns, st.st_size
+
+    def _load(self):
+        # 在 _lock 外解析整个日志，解析完成后一次性替换内存视图
+        index: Dict[str, Tuple[int, int]] = {}
+        entries: Dict[str, Dict[str, Any]] = {}
+        garbage = 0
+        valid_end = 0
+        with open(self.log_file, 'rb') as f:
+            offset = 0
+            for line in f:
+                length = len(line)
+                if not line.endswith(b"\n"):
+                    logger.warning(f"日记日志末尾存在不完整记录，已截断 (偏移: {offset})")
+                    break
+                try:
+                    record = json.loads(line)
+                    diary_date, entry = record["date"], record["entry"]
+                except Exception:
+                    logger.warning(f"跳过损坏的日记日志记录 (偏移: {offset})")
+                    garbage += 1
+                else:
+                    if diary_date in index:
+                        garbage += 1
+                    index[diary_date] = (offset, length)
+                    entries[diary_date] = entry
+                offset += length
+                valid_end = offset
+        if valid_end != self.log_file.stat().st_size:
+            with open(self.log_file, 'r+b') as f:
+                f.truncate(valid_end)
+        dates = sorted(entries)
+        stat = self._file_stat()
+        with self._lock:
+            self._index, self._entries, self._dates, self._garbage = index, entries, dates, garbage
+            self._version += 1
+            self._stat = stat
+
+    def changed_on_disk(self) -> bool:
+        # 只比较 mtime/大小，开销很小，可在事件循环中调用；写入进行中也可能返回 True，由 refresh_if_changed 复核
+        try:
+            return self._file_stat() != self._stat
+        except FileNotFoundError:
+            return True
+
+    def refresh_if_changed(self) -> bool:
+        # 日志文件被外部修改时重新加载，返回是否重新加载过；可能读取整个日志，应在工作线程中调用
+        with self._write_lock:
+            if not self.changed_on_disk():
+                return False
+            logger.info("检测到日记日志在外部被修改，重新加载")
+            self.open()
+            return True
+
+    def __contains__(self, diary_date: str) -> bool:
+        with self._lock:
+            return diary_date in self._entries
+
+    def __len__(self) -> int:
+        with self._lock:
+            return len(self._dates)
+
+    def dates(self) -> List[str]:
+        with self._lock:
+            return list(self._dates)
+
+    def get(self, diary_date: str) -> Optional[Dict[str, Any]]:
+        with self._lock:
+            return self._entries.get(diary_date)
+
+    def get_many(self, diary_dates: List[str]) -> Dict[str, Dict[str, Any]]:
+        with self._lock:
+            return {d: self._entries[d] for d in diary_dates if d in self._entries}
+
+    def range(self, start: str = "", end: str = "\uffff", reverse: bool = False,
+              offset: int = 0, limit: Optional[int] = None) -> List[Tuple[str, Dict[str, Any]]]:
+        # 按日期区间 [start, end] 取日记，通过二分定位区间，只构造返回的 offset..offset+limit 条
+        with self._lock:
+            lo = bisect.bisect_left(self._dates, start)
+            hi = bisect.bisect_right(self._dates, end)
+            if reverse:
+                stop = hi - offset
+                begin = max(lo, stop - limit) if limit is not None else lo
+                dates = reversed(self._dates[begin:max(begin, stop)])
+            else:
+                begin = lo + offset
+                dates = self._dates[begin:hi if limit is None else min(hi, begin + limit)]
+            return [(d, self._entries[d]) for d in dates]
+
+    def count(self, start: str = "", end: str = "\uffff") -> int:
+        with self._lock:
+            return bisect.bisect_right(self._dates, end) - bisect.bisect_left(self._dates, start)
+
+    def load_all(self) -> Dict[str, Dict[str, Any]]:
+        with self._lock:
+            return dict(self._entries)
+
+    def put(self, diary_date: str, entry: Dict[str, Any]):
+        self.put_many({diary_date: entry})
+
+    def put_many(self, entries: Dict[str, Dict[str, Any]]):
+        # 多篇日记一次追加、一次 fsync，版本号只递增一次；写盘期间不持有 _lock，写完后再发布到内存视图
+        records = [(diary_date, self._encode(diary_date, entry)) for diary_date, entry in entries.items()]
+        with self._write_lock:
+            self.refresh_if_changed()
+            with open(self.log_file, 'ab') as f:
+                offset = f.tell()
+                f.write(b"".join(record for _, record in records))
+                f.flush()
+                os.fsync(f.fileno())
+            stat = self._file_stat()
+            with self._lock:
+                for diary_date, record in records:
+                    if diary_date in self._index:
+                        self._garbage += 1
+                    else:
+                        bisect.insort(self._dates, diary_date)
+                    self._index[diary_date] = (offset, len(record))
+                    self._entries[diary_date] = entries[diary_date]
+                    offset += len(record)
+                self._version += 1
+                self._stat = stat
+
+    @property
+    def version(self) -> int:
+        return self._version
+
+    def needs_compaction(self) -> bool:
+        return (self._garbage >= self.COMPACT_MIN_GARBAGE
+                and self._garbage >= len(self._index) * self.COMPACT_GARBAGE_RATIO)
+
+    def compact(self):
+        # 在锁外写入临时文件，写入期间如有新的追加则放弃本次压缩，避免长时间阻塞读写
+        with self._lock:
+            version = self._version
+            entries = [(d, self._entries[d]) for d in self._dates]
+            removed = self._garbage
+        tmp_file = self.log_file.with_suffix(".log.tmp")
+        index = {}
+        with open(tmp_file, 'wb') as f:
+            for diary_date, entry in entries:
+                record = self._encode(diary_date, entry)
+                index[diary_date] = (f.tell(), len(record))
+                f.write(record)
+            f.flush()
+            os.fsync(f.fileno())
+        with self._write_lock:
+            if version != self._version:
+                os.remove(tmp_file)
+                logger.info("压缩期间日记日志有新的写入，本次压缩取消")
+                return
+            os.replace(tmp_file, self.log_file)
+            stat = self._file_stat()
+            with self._lock:
+                self._index = index
+                self._garbage = 0
+                self._stat = stat
+        logger.info(f"日记日志压缩完成，回收 {removed} 条过期记录")
+
+
+class DiarySearchIndex:
+    """日记全文检索：基于中文字符二元组（bigram）的倒排索引。
+
+    每篇日记的二元组词频作为一条记录追加保存在 dog_diaries.json 旁的 search_index.log 中（复用 DiaryStore
+    的追加日志格式），保存日记时增量更新；启动时从记录重建内存中的倒排表，并按内容校验值补建缺失或过期的条目。
+    查询对关键词的所有二元组求倒排表交集，按 BM25 打分排序，原文包含完整关键词的结果优先。
+    """
+
+    K1 = 1.2
+    B = 0.75
+
+    def __init__(self, index_file: Path):
+        self.records = DiaryStore(index_file)
+        self._postings: Dict[str, Dict[str, int]] = {}
+        self._lengths: Dict[str, int] = {}
+        self._built_version = -1
+        self._lock = threading.RLock()
+        # 串行化索引写入；写盘期间不持有查询使用的 _lock
+        self._write_lock = threading.RLock()
+
+    @staticmethod
+    def tokenize(text: str) -> Dict[str, int]:
+        grams: Dict[str, int] = {}
+        for run in re.findall(r"[\w\u4e00-\u9fff]+", text.lower()):
+            if len(run) == 1:
+                grams[run] = grams.get(run, 0) + 1
+            for i in range(len(run) - 1):
+                gram = run[i:i + 2]
+                grams[gram] = grams.get(gram, 0) + 1
+        return grams
+
+    @staticmethod
+    def _signature(content: str) -> int:
+        return zlib.crc32(content.encode('utf-8'))
+
+    def open(self, diaries: DiaryStore):
+        with self._write_lock:
+            self.records.open()
+            with self._lock:
+                self._rebuild_postings()
+            self.sync(diaries)
+
+    def sync(self, diaries: DiaryStore):
+        # 按内容校验值为缺失或过期的日记补建索引，日记日志被重新加载后也需调用，在工作线程中执行
+        with self._write_lock:
+            stale = {d: entry.get('content', '') for d, entry in diaries.range()
+                     if (self.records.get(d) or {}).get("sig") != self._signature(entry.get('content', ''))}
+            if stale:
+                # 全部缺失或过期的条目一次写入、一次 fsync
+                self.add_many(stale)
+                logger.info(f"已为 {len(stale)} 篇日记补建全文索引")
+
+    def _rebuild_postings(self):
+        self._postings.clear()
+        self._lengths.clear()
+        for diary_date, record in self.records.range():
+            self._index_document(diary_date, record["tf"], record["len"])
+        self._built_version = self.records.version
+
+    def _index_document(self, diary_date: str, tf: Dict[str, int], length: int):
+        for gram, count in tf.items():
+            self._postings.setdefault(gram, {})[diary_date] = count
+        self._lengths[diary_date] = length
+
+    def add(self, diary_date: str, content: str):
+        self.add_many({diary_date: content})
+
+    def add_many(self, documents: Dict[str, str]):
+        records = {}
+        for diary_date, content in documents.items():
+            tf = self.tokenize(content)
+            records[diary_date] = {"sig": self._signature(content), "len": sum(tf.values()), "tf": tf}
+        with self._write_lock:
+            old_records = self.records.get_many(list(records))
+            self.records.put_many(records)
+            with self._lock:
+                if self._built_version != self.records.version - 1:
+                    self._rebuild_postings()
+                    return
+                for diary_date, record in records.items():
+                    old = old_records.get(diary_date)
+                    if old:
+                        for gram in old["tf"]:
+                            postings = self._postings.get(gram)
+                            if postings is not None:
+                                postings.pop(diary_date, None)
+                                if not postings:
+                                    del self._postings[gram]
+                    self._index_document(diary_date, record["tf"], record["len"])
+                self._built_version = self.records.version
+
+    def search(self, query: str) -> List[Tuple[str, float]]:
+        query_grams = self.tokenize(query)
+        if not query_grams:
+            return []
+        # 可能需要重建倒排表，应在工作线程中调用；先等待进行中的写入完成，加锁顺序与 add_many 一致
+        if self._built_version != self.records.version:
+            with self._write_lock, self._lock:
+                if self._built_version != self.records.version:
+                    self._rebuild_postings()
+        with self._lock:
+            if any(len(g) == 1 for g in query_grams):
+                # 单字查询：合并所有包含该字的二元组的倒排表
+                postings_list = [self._merge_postings(g) if len(g) == 1 else self._postings.get(g, {})
+                                 for g in query_grams]
+            else:
+                postings_list = [self._postings.get(g, {}) for g in query_grams]
+            if not all(postings_list):
+                return []
+            postings_list.sort(key=len)
+            candidates = set(postings_list[0])
+            for postings in postings_list[1:]:
+                candidates.intersection_update(postings)
+                if not candidates:
+                    return []
+            total = len(self._lengths)
+            avg_length = sum(self._lengths.values()) / total
+            scores = {}
+            for diary_date in candidates:
+                length = self._lengths[diary_date]
+                score = 0.0
+                for postings in postings_list:
+                    tf = postings[diary_date]
+                    idf = math.log(1 + (total - len(postings) + 0.5) / (len(postings) + 0.5))
+                    score += idf * tf * (self.K1 + 1) / (tf + self.K1 * (1 - self.B + self.B * length / avg_length))
+                scores[diary_date] = score
+        return sorted(scores.items(), key=lambda x: x[1], reverse=True)
+
+    def _merge_postings(self, char: str) -> Dict[str, int]:
+        merged: Dict[str, int] = {}
+        for gram, postings in self._postings.items():
+            if char in gram:
+                for diary_date, count in postings.items():
+                    merged[diary_date] = merged.get(diary_date, 0) + count
+        return merged
+
+
+class OriginalsArchive:
+    """日记原文归档：按月打包的追加写入压缩包，保留每一次生成和重写的版本。
+
+    每个月一个 <YYYY-MM>.pack，记录为 定长头（日期、长度、CRC32）+ zlib 压缩的 JSON，只追加不修改；
+    同名 .idx 逐行记录每个版本的 (日期, 偏移, 长度)，启动时加载到内存，按日期读取任意版本只需一次 seek。
+    索引落后于数据包时（例如写入中途退出）从最后一个已索引的位置重新扫描补齐，不完整的尾部记录会被截断。
+    旧版本按天保存的 diary_<日期>.txt 在首次打开时导入对应月份的包并删除。
+    """
+
+    HEADER = struct.Struct(">10sII")
+
+    def __init__(self, directory: Path):
+        self.directory = directory
+        self._index: Dict[str, List[Tuple[int, int]]] = {}
+        self._lock = threading.Lock()
+
+    def _pack_file(self, month: str) -> Path:
+        return self.directory / f"{month}.pack"
+
+    def _index_file(self, month: str) -> Path:
+        return self.directory / f"{month}.idx"
+
+    def open(self):
+        with self._lock:
+            self.directory.mkdir(parents=True, exist_ok=True)
+            self._index.clear()
+            for pack_file in sorted(self.directory.glob("*.pack")):
+                self._load_month(pack_file.stem)
+        self._migrate_text_files()
+
+    def _load_month(self, month: str):
+        pack_file, index_file = self._pack_file(month), self._index_file(month)
+        indexed_end = 0
+        pack_size = pack_file.stat().st_size
+        lines = []
+        if index_file.exists():
+            with open(index_file, 'r', encoding='utf-8') as f:
+                for line in f:
+                    try:
+                        diary_date, offset, length = line.split()
+                        offset, length = int(offset), int(length)
+                    except ValueError:
+                        break
+                    if offset + length > pack_size:
+                        break
+                    lines.append((diary_date, offset, length))
+                    indexed_end = max(indexed_end, offset + length)
+        recovered = self._scan(pack_file, indexed_end)
+        if recovered or len(lines) != self._count_lines(index_file):
+            # 索引与数据包不一致时重写索引文件
+            lines += recovered
+            write_file_atomic(index_file, "".join(f"{d} {o} {n}\n" for d, o, n in lines))
+            if recovered:
+                logger.info(f"已从原文归档 {pack_file.name} 补齐 {len(recovered)} 条索引")
+        for diary_date, offset, length in lines:
+            self._index.setdefault(diary_date, []).append((offset, length))
+
+    def _scan(self, pack_file: Path, start: int) -> List[Tuple[str, int, int]]:
+        recovered = []
+        valid_end = start
+        with open(pack_file, 'rb') as f:
+            f.seek(start)
+            while True:
+                header = f.read(self.HEADER.size)
+                if len(header) < self.HEADER.size:
+                    break
+                raw_date, size, checksum = self.HEADER.unpack(header)
+                payload = f.read(size)
+                if len(payload) < size or zlib.crc32(payload) != checksum:
+                    break
+                recovered.append((raw_date.decode('ascii'), valid_end, self.HEADER.size + size))
+                valid_end += self.HEADER.size + size
+        if valid_end != pack_file.stat().st_size:
+            logger.warning(f"原文归档 {pack_file.name} 末尾存在不完整记录，已截断 (偏移: {valid_end})")
+            with open(pack_file, 'r+b') as f:
+                f.truncate(valid_end)
+        return recovered
+
+    @staticmethod
+    def _count_lines(path: Path) -> int:
+        if not path.exists():
+            return 0
+        with open(path, 'rb') as f:
+            return sum(1 for _ in f)
+
+    def append(self, diary_date: str, time_str: str, content: str, saved: str = ""):
+        record = {"time": time_str, "content": content, "saved": saved or datetime.now().isoformat(timespec="seconds")}
+        payload = zlib.compress(json.dumps(record, ensure_ascii=False).encode('utf-8'), 9)
+        data = self.HEADER.pack(diary_date.encode('ascii'), len(payload), zlib.crc32(payload)) + payload
+        month = diary_date[:7]
+        with self._lock:
+            pack_file = self._pack_file(month)
+            with open(pack_file, 'ab') as f:
+                offset = f.tell()
+                f.write(data)
+                f.flush()
+                os.fsync(f.fileno())
+            with open(self._index_file(month), 'a', encoding='utf-8') as f:
+                f.write(f"{diary_date} {offset} {len(data)}\n")
+            self._index.setdefault(diary_date, []).append((offset, len(data)))
+
+    def versions(self, diary_date: str) -> int:
+        with self._lock:
+            return len(self._index.get(diary_date, []))
+
+    def load(self, diary_date: str, version: int = -1) -> Optional[Dict[str, Any]]:
+        # version 为版本序号，-1 表示最近一次写入的版本
+        with self._lock:
+            versions = self._index.get(diary_date)
+            if not versions:
+                return None
+            offset, length = versions[version]
+            with open(self._pack_file(diary_date[:7]), 'rb') as f:
+                f.seek(offset)
+                data = f.read(length)
+        _, size, checksum = self.HEADER.unpack_from(data)
+        payload = data[self.HEADER.size:]
+        if len(payload) != size or zlib.crc32(payload) != checksum:
+            raise ValueError(f"原文归档记录校验失败 (日期: {diary_date})")
+        return json.loads(zlib.decompress(payload))
+
+    def _migrate_text_files(self):
+        text_files = sorted(self.directory.glob("diary_*.txt"))
+        if not text_files:
+            return
+        migrated = 0
+        for text_file in text_files:
+            diary_date = text_file.stem[len("diary_"):]
+            try:
+                date.fromisoformat(diary_date)
+                with open(text_file, 'r', encoding='utf-8') as f:
+                    text = f.read()
+            except (ValueError, OSError) as e:
+                logger.error(f"迁移日记原文 {text_file.name} 时出错，保留原文件: {e}")
+                continue
+            match = re.match(r"【舔狗日记 - (.*?)】\n(.*?)\n?\Z", text, re.S)
+            time_str, content = (match.group(1), match.group(2)) if match else ("", text)
+            latest = self.load(diary_date)
+            # 上次迁移中途退出时，已经导入的文件不再重复导入
+            if not latest or latest["content"] != content:
+                saved = datetime.fromtimestamp(text_file.stat().st_mtime).isoformat(timespec="seconds")
+                self.append(diary_date, time_str, content, saved)
+            text_file.unlink()
+            migrated += 1
+        if migrated:
+            logger.info(f"已将 {migrated} 个日记原文文件迁移到按月归档的原文包")
+
+
+def write_file_atomic(path: Path, text: str):
+    # 先写临时文件并落盘，再原子替换目标文件，写入中途崩溃也不会留下被截断的文件
+    tmp_file = path.with_name(path.name + ".tmp")
+    with open(tmp_file, 'w', encoding='utf-8') as f:
+        f.write(text)
+        f.flush()
+        os.fsync(f.fileno())
+    os.replace(tmp_file, path)
+
+
+class AtomicFileWriter:
+    """异步持久化：文件写入在工作线程中执行，同一文件的写入串行化，并合并排队中的重复写入。
+
+    序列化在调用方协程中完成，保证写入的是调用时刻的数据快照；排队期间若同一文件又有新的写入请求，
+    只落盘最新的快照。
+    """
+
+    def __init__(self):
+        self._locks: Dict[Path, asyncio.Lock] = {}
+        self._pending: Dict[Path, str] = {}
+
+    async def write_json(self, path: Path, data: Any):
+        await self.write_text(path, json.dumps(data, ensure_ascii=False, indent=4))
+
+    async def write_text(self, path: Path, text: str):
+        self._pending[path] = text
+        async with self._locks.setdefault(path, asyncio.Lock()):
+            text = self._pending.pop(path, None)
+            if text is None:
+                return  # 排队期间已由后来的写入一并落盘
+            await asyncio.to_thread(write_file_atomic, path, text)
+
+
+class LexiconEmotionScorer:
+    """基于中文情感词典的本地情感强度评分器，无需调用 LLM。
+
+    按情感词权重累加，前置程度副词放大、否定词减弱，再叠加感叹号、省略号等标点特征，
+    以每百字的加权命中数映射到 1-10 分。
+    """
+
+    LEXICON = {
+        3.0: ["心碎", "绝望", "崩溃", "痛苦", "撕心裂肺", "心如刀割", "泪流满面", "痛哭", "哭了", "生不如死",
+              "不想活", "心痛", "疯了", "彻底", "永远", "狂喜", "激动", "幸福死", "爱死", "肝肠寸断", "万念俱灰"],
+        2.0: ["难过", "伤心", "失落", "委屈", "心酸", "孤独", "寂寞", "想你", "思念", "眼泪", "哭", "害怕",
+              "后悔", "卑微", "心疼", "难受", "开心", "高兴", "兴奋", "期待", "紧张", "心动", "喜欢", "爱你",
+              "生气", "嫉妒", "吃醋", "舍不得", "拉黑", "删了", "分手", "失眠", "熬夜"],
+        1.0: ["无奈", "叹气", "郁闷", "失望", "尴尬", "犹豫", "担心", "想念", "等待", "笑", "感动", "温暖",
+              "在乎", "舔狗", "已读不回", "没回", "不回", "冷淡", "敷衍", "算了", "心里", "默默"],
+    }
+    INTENSIFIERS = ["非常", "特别", "超级", "十分", "极其", "无比", "真的", "太", "好", "真", "最", "超", "巨"]
+    NEGATIONS = ["不", "没", "别", "无"]
+
+    def __init__(self):
+        self._weights: Dict[str, float] = {}
+        for weight, words in self.LEXICON.items():
+            for word in words:
+                self._weights[word] = weight
+        words = sorted(self._weights, key=len, reverse=True)
+        self._pattern = re.compile("|".join(map(re.escape, words)))
+        self._punctuation = re.compile(r"[!！]+|[?？][!！]|…+|\.{3,}|(哈){2,}|(呜){2,}")
+
+    def score(self, content: str) -> int:
+        if not content:
+            return 1
+        total = 0.0
+        for match in self._pattern.finditer(content):
+            weight = self._weights[match.group()]
+            prefix = content[max(0, match.start() - 2):match.start()]
+            if any(prefix.endswith(word) for word in self.INTENSIFIERS):
+                weight *= 1.5
+            if prefix.endswith(tuple(self.NEGATIONS)) and not match.group().startswith(tuple(self.NEGATIONS)):
+                weight *= 0.5
+            total += weight
+        total += 0.5 * len(self._punctuation.findall(content))
+        density = total * 100 / max(len(content), 150)
+        return max(1, min(10, round(1 + 9 * (1 - math.exp(-density / 6)))))
+
+
+def calibrate_emotion_scorer(scorer: LexiconEmotionScorer, diaries: Dict[str, Dict[str, Any]],
+                             threshold: int) -> Dict[str, Any]:
+    """对比本地评分与日记中已保存的 emotion_score，返回样本数、平均绝对误差、相关系数和重要标记一致率。"""
+    pairs = [(scorer.score(d.get('content', '')), d['emotion_score'])
+             for d in diaries.values() if isinstance(d.get('emotion_score'), int) and d['emotion_score'] > 0]
+    if not pairs:
+        return {"samples": 0}
+    local, stored = zip(*pairs)
+    n = len(pairs)
+    mean_local, mean_stored = sum(local) / n, sum(stored) / n
+    cov = sum((a - mean_local) * (b - mean_stored) for a, b in pairs)
+    var_local = sum((a - mean_local) ** 2 for a in local)
+    var_stored = sum((b - mean_stored) ** 2 for b in stored)
+    return {
+        "samples": n,
+        "mae": sum(abs(a - b) for a, b in pairs) / n,
+        "bias": mean_local - mean_stored,
+        "correlation": cov / math.sqrt(var_local * var_stored) if var_local and var_stored else 0.0,
+        "important_agreement": sum((a >= threshold) == (b >= threshold) for a, b in pairs) / n,
+    }
+
+
+class PipelineMetrics:
+    """插件运行指标：各阶段耗时、LLM 调用与字数、缓存命中率和各群发送失败次数。
+
+    仅保存在内存中，插件重载后清零；span() 超过 SLOW_SPAN_MS 的阶段会以 info 级别写入日志，
+    其余为 debug 级别，便于定位一次慢请求的时间花在哪个阶段。
+    """
+
+    STAGES = {
+        "load": "读取日记",
+        "history": "历史总结",
+        "summarize": "单篇摘要",
+        "generate": "日记生成",
+        "first_chunk": "首段送达",
+        "emotion": "情感评分",
+        "save": "保存日记",
+        "backup": "备份原文",
+        "broadcast": "定时群发",
+        "send": "单群发送",
+    }
+    CACHES = {
+        "today": "今日日记",
+        "history": "历史总结",
+        "summary": "单篇摘要",
+    }
+
+    def __init__(self):
+        self.started = datetime.now()
+        self.spans: Dict[str, List[float]] = {}
+        self.counters: Dict[str, int] = {}
+        self.send_failures: Dict[str, int] = {}
+        self.version = 0
+
+    @contextlib.contextmanager
+    def span(self, stage: str):
+        started = time.perf_counter()
+        try:
+            yield
+        finally:
+            self.record(stage, (time.perf_counter() - started) * 1000)
+
+    def record(self, stage: str, elapsed: float):
+        # [次数, 总耗时, 最大耗时, 最近一次耗时]
+        stat = self.spans.setdefault(stage, [0, 0.0, 0.0, 0.0])
+        stat[0] += 1
+        stat[1] += elapsed
+        stat[2] = max(stat[2], elapsed)
+        stat[3] = elapsed
+        self.version += 1
+        log = logger.info if elapsed >= SLOW_SPAN_MS else logger.debug
+        log(f"[耗时] {self.STAGES.get(stage, stage)}: {elapsed:.0f} ms")
+
+    def incr(self, name: str, value: int = 1):
+        self.counters[name] = self.counters.get(name, 0) + value
+        self.version += 1
+
+    def cache(self, name: str, hit: bool):
+        self.incr(f"cache_{name}_{'hit' if hit else 'miss'}")
+
+    def send_failed(self, group_id: str):
+        self.send_failures[group_id] = self.send_failures.get(group_id, 0) + 1
+        self.version += 1
+
+    def report(self) -> str:
+        lines = [f"统计开始于 {self.started.strftime('%Y-%m-%d %H:%M:%S')}", "", "各阶段耗时（次数 / 平均 / 最大 / 最近）:"]
+        for stage, label in self.STAGES.items():
+            stat = self.spans.get(stage)
+            if stat:
+                lines.append(f"- {label}: {stat[0]} 次 / {stat[1] / stat[0]:.0f} ms / {stat[2]:.0f} ms / {stat[3]:.0f} ms")
+        counters = self.counters
+        lines += ["", "LLM 调用:"]
+        for site in sorted({key.split(".", 1)[1] for key in counters if key.startswith("llm_calls.")}):
+            lines.append(f"- {site}: {counters.get(f'llm_calls.{site}', 0)} 次，失败 {counters.get(f'llm_errors.{site}', 0)} 次，"
+                         f"重试 {counters.get(f'llm_retries.{site}', 0)} 次，对冲 {counters.get(f'llm_hedged.{site}', 0)} 次，"
+                         f"熔断 {counters.get(f'llm_circuit_open.{site}', 0)} 次，"
+                         f"提示词 {counters.get(f'prompt_chars.{site}', 0)} 字，回复 {counters.get(f'response_chars.{site}', 0)} 字")
+        lines += ["", "缓存命中率:"]
+        for name, label in self.CACHES.items():
+            hit, miss = counters.get(f"cache_{name}_hit", 0), counters.get(f"cache_{name}_miss", 0)
+            if hit + miss:
+                lines.append(f"- {label}: {hit / (hit + miss):.0%} ({hit}/{hit + miss})")
+        lines += ["", f"群发: 成功 {counters.get('send_ok', 0)} 次，失败 {counters.get('send_failed', 0)} 次"]
+        for group_id, failures in sorted(self.send_failures.items(), key=lambda x: -x[1])[:10]:
+            lines.append(f"- 群 {group_id}: 失败 {failures} 次")
+        return "\n".join(lines)
+
+
+class CircuitBreaker:
+    """单个 LLM 调用位置的熔断器。
+
+    连续失败 threshold 次后熔断 cooldown 秒，期间不再请求当前提供商；冷却结束后放行一次试探请求，
+    成功则恢复，失败则重新计时。
+    """
+
+    def __init__(self, threshold: int = 5, cooldown: float = 120):
+        self.threshold = threshold
+        self.cooldown = cooldown
+        self.failures = 0
+        self._opened_at: Optional[float] = None
+        self._probing = False
+
+    @property
+    def state(self) -> str:
+        if self._opened_at is None:
+            return "closed"
+        return "half-open" if time.monotonic() - self._opened_at >= self.cooldown else "open"
+
+    def allow(self) -> bool:
+        if self._opened_at is None:
+            return True
+        if time.monotonic() - self._opened_at >= self.cooldown and not self._probing:
+            self._probing = True
+            return True
+        return False
+
+    def record(self, success: bool):
+        self._probing = False
+        if success:
+            self.failures = 0
+            self._opened_at = None
+            return
+        self.failures += 1
+        if self._opened_at is not None or self.failures >= self.threshold:
+            self._opened_at = time.monotonic()
+
+
+class LLMResponseError(RuntimeError):
+    """LLM 提供商返回了错误响应（role 不是 assistant）：按失败处理以触发重试和熔断，最后一次仍失败时原样返回该响应。"""
+
+    def __init__(self, response):
+        super().__init__(response.completion_text or f"LLM 返回无效响应 (role: {response.role})")
+        self.response = response
+
+
+class TokenBucket:
+    """按平台限制发送速率的令牌桶，rate 为每秒补充的令牌数，capacity 为允许的突发量。"""
+
+    def __init__(self, rate: float, capacity: int):
+        self.rate = max(rate, 0.01)
+        self.capacity = capacity
+        self._tokens = float(capacity)
+        self._updated = time.monotonic()
+        self._lock = asyncio.Lock()
+
+    async def acquire(self):
+        async with self._lock:
+            while True:
+                now = time.monotonic()
+                self._tokens = min(self.capacity, self._tokens + (now - self._updated) * self.rate)
+                self._updated = now
+                if self._tokens >= 1:
+                    self._tokens -= 1
+                    return
+                await asyncio.sleep((1 - self._tokens) / self.rate)
+
+
+class DateRuns:
+    """日期连续区间集合（以 date.toordinal() 表示），用于增量维护连续天数。"""
+
+    def __init__(self):
+        self._starts: List[int] = []
+        self._ends: Dict[int, int] = {}
+
+    def reset(self, runs: List[Tuple[int, int]]):
+        self._starts = [start for start, _ in runs]
+        self._ends = dict(runs)
+
+    def _find(self, day: int) -> int:
+        i = bisect.bisect_right(self._starts, day) - 1
+        return i if i >= 0 and self._ends[self._starts[i]] >= day else -1
+
+    def add(self, day: int):
+        if self._find(day) >= 0:
+            return
+        start, end = day, day
+        i = bisect.bisect_left(self._starts, day)
+        if i > 0 and self._ends[self._starts[i - 1]] == day - 1:
+            start = self._starts.pop(i - 1)
+            del self._ends[start]
+            i -= 1
+        if i < len(self._starts) and self._starts[i] == day + 1:
+            end = self._ends.pop(self._starts.pop(i))
+        self._starts.insert(i, start)
+        self._ends[start] = end
+
+    def remove(self, day: int):
+        i = self._find(day)
+        if i < 0:
+            return
+        start = self._starts.pop(i)
+        end = self._ends.pop(start)
+        for run_start, run_end in ((day + 1, end), (start, day - 1)):
+            if run_start <= run_end:
+                self._starts.insert(i, run_start)
+                self._ends[run_start] = run_end
+
+    def longest(self) -> Tuple[int, int]:
+        # 返回最长区间的 (起点, 终点)，为空时返回 (0, -1)
+        return max(self._ends.items(), key=lambda x: (x[1] - x[0], x[0]), default=(0, -1))
+
+    def ending_at(self, day: int) -> int:
+        # 截止到 day（含）或前一天的当前连续天数
+        i = self._find(day)
+        if i < 0:
+            i = self._find(day - 1)
+        return self._ends[self._starts[i]] - self._starts[i] + 1 if i >= 0 else 0
+
+
+class EmotionRollup:
+    """情感强度统计汇总：按周、按月的篇数/评分和/重要篇数，评分分布，各评分的日期列表和连续天数。
+
+    随每次保存日记增量更新（先减去旧记录的贡献再加上新记录），统计指令直接读取，不再扫描全部日记；
+    日志被外部修改等原因导致版本不连续时整体重建，安装了 numpy 时重建使用向量化计算。
+    评分为 0 表示未能评分，不计入平均值和分布。
+    """
+
+    def __init__(self):
+        self.weeks: Dict[str, List[int]] = {}
+        self.months: Dict[str, List[int]] = {}
+        self.distribution = [0] * 11
+        self.by_score: Dict[int, List[str]] = {score: [] for score in range(11)}
+        self.days = DateRuns()
+        self.important_days = DateRuns()
+        self.total = 0
+        self.important = 0
+        self._built_version = -1
+        self.lock = threading.RLock()
+
+    @staticmethod
+    def _score(entry: Dict[str, Any]) -> int:
+        try:
+            return min(10, max(0, int(entry.get('emotion_score', 0))))
+        except (TypeError, ValueError):
+            return 0
+
+    @staticmethod
+    def week_of(diary_date: str) -> str:
+        day = date.fromisoformat(diary_date)
+        return (day - timedelta(days=day.weekday())).isoformat()
+
+    def sync(self, store: "DiaryStore"):
+        with self.lock:
+            if self._built_version != store.version:
+                self.rebuild(store.load_all(), store.version)
+
+    def rebuild(self, diaries: Dict[str, Dict[str, Any]], version: int):
+        dates = sorted(diaries)
+        scores = [self._score(diaries[d]) for d in dates]
+        important = [bool(diaries[d].get('important', False)) for d in dates]
+        with self.lock:
+            if np is not None and dates:
+                self._rebuild_vectorized(dates, scores, important)
+            else:
+                self._rebuild_python(dates, scores, important)
+            self.total = len(dates)
+            self.important = sum(important)
+            self._built_version = version
+
+    def _rebuild_python(self, dates: List[str], scores: List[int], important: List[bool]):
+        self.weeks, self.months = {}, {}
+        self.distribution = [0] * 11
+        self.by_score = {score: [] for score in range(11)}
+        self.days, self.important_days = DateRuns(), DateRuns()
+        for diary_date, score, is_important in zip(dates, scores, important):
+            self.days.add(date.fromisoformat(diary_date).toordinal())
+            self._add(diary_date, score, is_important)
+
+    def _rebuild_vectorized(self, dates: List[str], scores: List[int], important: List[bool]):
+        days = np.array(dates, dtype='datetime64[D]')
+        score_array = np.array(scores, dtype=np.int64)
+        important_array = np.array(important, dtype=bool)
+        scored = (score_array > 0).astype(np.int64)
+        ordinals = days.astype(np.int64)
+        # 1970-01-01 是周四，(天数 + 3) % 7 为周一起算的星期序号
+        week_starts = days - ((ordinals + 3) % 7).astype('timedelta64[D]')
+        self.weeks = self._group(week_starts.astype(str), scored, score_array, important_array)
+        self.months = self._group(days.astype('datetime64[M]').astype(str), scored, score_array, important_array)
+        self.distribution = np.bincount(score_array, minlength=11).tolist()
+        order = np.lexsort((ordinals, score_array))
+        date_strings = days.astype(str)
+        self.by_score = {score: [] for score in range(11)}
+        for score, group in zip(*self._split(score_array[order], date_strings[order])):
+            self.by_score[int(score)] = group.tolist()
+        self.days, self.important_days = DateRuns(), DateRuns()
+        epoch = date(1970, 1, 1).toordinal()
+        for runs, selected in ((self.days, ordinals), (self.important_days, ordinals[important_array])):
+            if not len(selected):
+                continue
+            breaks = np.flatnonzero(np.diff(selected) != 1)
+            starts = np.concatenate(([selected[0]], selected[breaks + 1])) + epoch
+            ends = np.concatenate((selected[breaks], [selected[-1]])) + epoch
+            runs.reset(list(zip(starts.tolist(), ends.tolist())))
+
+    @staticmethod
+    def _split(keys, values):
+        # keys 已排序，按相同的 key 切分 values
+        boundaries = np.flatnonzero(keys[1:] != keys[:-1]) + 1
+        return keys[np.concatenate(([0], boundaries))], np.split(values, boundaries)
+
+    @staticmethod
+    def _group(keys, scored, scores, important) -> Dict[str, List[int]]:
+        unique, inverse = np.unique(keys, return_inverse=True)
+        sums = [np.bincount(inverse, weights=w, minlength=len(unique)).astype(np.int64)
+                for w in (np.ones(len(keys)), scored, scores, important)]
+        return {key: [int(s[i]) for s in sums] for i, key in enumerate(unique.tolist())}
+
+    def _add(self, diary_date: str, score: int, is_important: bool, sign: int = 1):
+        for buckets, key in ((self.weeks, self.week_of(diary_date)), (self.months, diary_date[:7])):
+            bucket = buckets.setdefault(key, [0, 0, 0, 0])
+            # [篇数, 已评分篇数, 评分和, 重要篇数]
+            bucket[0] += sign
+            bucket[1] += sign * (score > 0)
+            bucket[2] += sign * score
+            bucket[3] += sign * is_important
+            if not bucket[0]:
+                del buckets[key]
+        self.distribution[score] += sign
+        dates = self.by_score[score]
+        if sign > 0:
+            bisect.insort(dates, diary_date)
+        else:
+            i = bisect.bisect_left(dates, diary_date)
+            if i < len(dates) and dates[i] == diary_date:
+                dates.pop(i)
+        ordinal = date.fromisoformat(diary_date).toordinal()
+        if is_important and sign > 0:
+            self.important_days.add(ordinal)
+        elif is_important:
+            self.important_days.remove(ordinal)
+
+    def update(self, old: Dict[str, Dict[str, Any]], new: Dict[str, Dict[str, Any]], version: int,
+               store: "DiaryStore"):
+        # old 为写入前同日期的记录（新增日期不在其中），version 为写入后的存储版本
+        with self.lock:
+            if self._built_version != version - 1:
+                self.rebuild(store.load_all(), store.version)
+                return
+            for diary_date, entry in new.items():
+                previous = old.get(diary_date)
+                if previous is not None:
+                    self._add(diary_date, self._score(previous), bool(previous.get('important', False)), -1)
+                else:
+                    self.total += 1
+                    self.days.add(date.fromisoformat(diary_date).toordinal())
+                self.important += bool(entry.get('important', False)) - bool((previous or {}).get('important', False))
+                self._add(diary_date, self._score(entry), bool(entry.get('important', False)))
+            self._built_version = version
+
+    def top(self, limit: int) -> List[Tuple[str, int]]:
+        # 评分最高的日记，同分时较新的在前
+        with self.lock:
+            result = []
+            for score in range(10, 0, -1):
+                for diary_date in reversed(self.by_score[score]):
+                    if len(result) >= limit:
+                        return result
+                    result.append((diary_date, score))
+            return result
+
+
+class DiaryTimeline:
+    """一条独立的日记时间线：日记存储、全文索引、情感统计、总结缓存和原文备份目录。
+
+    未开启分群时间线时只有一条全局时间线，数据位于插件数据目录根部；开启后每个会话
+    （unified_msg_origin）在 timelines/ 下拥有自己的分片目录，并可覆盖日记风格和生成/发送时间。
+    """
+
+    def __init__(self, key: str, data_dir: Path, legacy_file: Optional[Path] = None):
+        self.key = key
+        self.data_dir = data_dir
+        self.store = DiaryStore(data_dir / "dog_diaries.log", legacy_file=legacy_file)
+        self.search_index = DiarySearchIndex(data_dir / "search_index.log")
+        self.summary_cache_file = data_dir / "summary_cache.json"
+        self.originals = OriginalsArchive(data_dir / "originals")
+        self.rollup = EmotionRollup()
+        self.summary_cache: Dict[str, Any] = {}
+        self.style: Optional[str] = None
+        self._compaction_task: Optional[asyncio.Future] = None
+        self._save_lock = threading.Lock()
+
+    def open(self):
+        self.originals.open()
+        self.store.open()
+        self.search_index.open(self.store)
+        self.rollup.sync(self.store)
+        self.summary_cache = self._load_summary_cache()
+        if self.compact_summary_cache():
+            write_file_atomic(self.summary_cache_file, json.dumps(self.summary_cache, ensure_ascii=False, indent=4))
+
+    def refresh(self) -> bool:
+        # 日记日志在外部被修改时重新加载，并为新增或改动的日记补建全文索引，在工作线程中调用
+        if not self.store.refresh_if_changed():
+            return False
+        self.search_index.sync(self.store)
+        return True
+
+    def save_entries(self, entries: Dict[str, Dict[str, Any]]):
+        # 写入存储并增量更新情感统计，在工作线程中调用。读取旧记录、写入和更新统计在同一把锁内完成，
+        # 否则并发重写同一日期时两次保存可能读到同一条旧记录，旧记录的贡献会被重复减去
+        with self._save_lock:
+            self.refresh()
+            old = self.store.get_many(list(entries))
+            self.store.put_many(entries)
+            self.rollup.update(old, entries, self.store.version, self.store)
+
+    def _load_summary_cache(self) -> Dict[str, Any]:
+        if not self.summary_cache_file.exists():
+            return {}
+        try:
+            with open(self.summary_cache_file, 'r', encoding='utf-8') as f:
+                return json.load(f)
+        except Exception as e:
+            logger.error(f"加载总结缓存文件时出错: {e}")
+            return {}
+
+    def compact_summary_cache(self) -> int:
+        # 只保留滚动历史状态和窗口内的单篇摘要；旧版按天保存的整段历史（summary_<今天>）一并清除
+        window_start = (date.today() - timedelta(days=HISTORY_WINDOW_DAYS)).isoformat()
+        expired = []
+        for key, value in self.summary_cache.items():
+            if key in (HISTORY_STATE_KEY, HISTORY_NEXT_KEY):
+                continue
+            diary_date = key[len("summary_"):] if key.startswith("summary_") else ""
+            if (not diary_date or diary_date < window_start or not isinstance(value, str)
+                    or not value.startswith(f"[摘要 {diary_date}]")):
+                expired.append(key)
+        for key in expired:
+            del self.summary_cache[key]
+        # 超出容量时按最近使用顺序淘汰最早的摘要（字典顺序即使用顺序）
+        overflow = len(self.summary_cache) - SUMMARY_CACHE_MAX_ENTRIES
+        if overflow > 0:
+            victims = [key for key in self.summary_cache if key not in (HISTORY_STATE_KEY, HISTORY_NEXT_KEY)][:overflow]
+            for key in victims:
+                del self.summary_cache[key]
+            expired.extend(victims)
+        if expired:
+            logger.info(f"已清理 {len(expired)} 条过期的总结缓存")
+        return len(expired)
+
+    def get_cached_summary(self, diary_date: str) -> str:
+        key = f"summary_{diary_date}"
+        cached = self.summary_cache.pop(key, None)
+        if not isinstance(cached, str) or not cached.startswith(f"[摘要 {diary_date}]"):
+            return ""
+        self.summary_cache[key] = cached
+        return cached
+
+    def mark_history_dirty(self, date_str: str):
+        # 只有早于滚动结果日期的日记才会出现在该结果的历史记录中
+        for key in (HISTORY_STATE_KEY, HISTORY_NEXT_KEY):
+            state = self.summary_cache.get(key)
+            if state and date_str < state.get("date", "") and date_str not in state.setdefault("dirty", []):
+                state["dirty"].append(date_str)
+
+    def schedule_compaction(self):
+        # 日记日志和全文索引日志都会因重写积累过期记录，分别按各自的垃圾比例压缩
+        stores = [store for store in (self.store, self.search_index.records) if store.needs_compaction()]
+        if not stores:
+            return
+        if self._compaction_task and not self._compaction_task.done():
+            return
+        self._compaction_task = asyncio.get_running_loop().run_in_executor(None, self._compact, stores)
+
+    @staticmethod
+    def _compact(stores: List[DiaryStore]):
+        for store in stores:
+            store.compact()
+
+
+class DailyScheduler:
+    """每日定时任务调度器。
+
+    所有任务共用一个循环，按固定间隔检查：任务当天的触发时间已过且上次成功运行早于该时间时执行，
+    同一轮中到期的任务按添加顺序依次执行（先生成后发送）。
+    上次成功运行时间持久化到文件，因此插件重启、系统休眠或时钟调整后会补跑当天错过的任务；
+    任务返回 False 时按 retry_interval 间隔重试。触发时间每次检查时重新读取，配置修改即时生效。
+    """
+
+    TICK_SECONDS = 30
+
+    def __init__(self, state_file: Path, writer: AtomicFileWriter, on_tick=None, retry_interval: int = 3600):
+        self.state_file = state_file
+        self.writer = writer
+        self.on_tick = on_tick
+        self.retry_interval = retry_interval
+        self._jobs: Dict[str, Tuple[Any, Any]] = {}
+        self._last_run: Dict[str, str] = {}
+        self._next_retry: Dict[str, float] = {}
+        self._task: Optional[asyncio.Task] = None
+
+    def add_job(self, name: str, time_getter, func):
+        self._jobs[name] = (time_getter, func)
+
+    def set_jobs(self, jobs: Dict[str, Tuple[Any, Any]]):
+        # 同一轮中按 预热 -> 生成 -> 发送 的顺序执行
+        order = {"warmup": 0, "generate": 1}
+        self._jobs = dict(sorted(jobs.items(), key=lambda x: order.get(x[0].split("@")[0], 2)))
+
+    def start(self):
+        # 重复调用不会启动第二个调度循环
+        if self._task and not self._task.done():
+            return
+        self._load_state()
+        self._task = asyncio.create_task(self._loop())
+
+    async def stop(self):
+        if self._task and not self._task.done():
+            self._task.cancel()
+            await asyncio.gather(self._task, return_exceptions=True)
+        logger.info("舔狗日记定时任务已停止")
+
+    def _load_state(self):
+        try:
+            with open(self.state_file, 'r', encoding='utf-8') as f:
+                self._last_run = json.load(f)
+        except FileNotFoundError:
+            self._last_run = {}
+        except Exception as e:
+            logger.error(f"加载定时任务状态文件时出错: {e}")
+            self._last_run = {}
+
+    async def _save_state(self):
+        try:
+            await self.writer.write_json(self.state_file, self._last_run)
+        except Exception as e:
+            logger.error(f"保存定时任务状态文件时出错: {e}")
+
+    async def _loop(self):
+        while True:
+            try:
+                if self.on_tick:
+                    self.on_tick()
+                await self._run_due_jobs(datetime.now())
+            except Exception as e:
+                logger.error(f"定时任务调度异常: {e}")
+            await asyncio.sleep(self.TICK_SECONDS)
+
+    async def _run_due_jobs(self, now: datetime):
+        for name, (time_getter, func) in list(self._jobs.items()):
+            try:
+                hour, minute = map(int, time_getter().split(':'))
+                due = now.replace(hour=hour, minute=minute, second=0, microsecond=0)
+            except Exception as e:
+                logger.error(f"定时任务 {name} 的时间配置无效: {e}")
+                continue
+            if now < due or self._last_run.get(name, "") >= due.isoformat():
+                continue
+            if time.monotonic() < self._next_retry.get(name, 0):
+                continue
+            await self._run_job(name, func, now)
+
+    async def _run_job(self, name: str, func, now: datetime):
+        try:
+            done = await func()
+        except asyncio.CancelledError:
+            raise
+        except Exception as e:
+            logger.error(f"定时任务 {name} 执行异常: {e}")
+            done = False
+        if done:
+            self._last_run[name] = now.isoformat(timespec="seconds")
+            self._next_retry.pop(name, None)
+            await self._save_state()
+        else:
+            self._next_retry[name] = time.monotonic() + self.retry_interval
+            logger.info(f"定时任务 {name} 未完成，将在 {self.retry_interval // 60} 分钟后重试")
+
 
 @register("astrbot_plugin_dogdiary", "大沙北", "每日一记的舔狗日记", "1.3.7", "https://github.com/bigshabei/astrbot_plugin_dogdiary")
 class LickDogDiaryPlugin(Star):
     def __init__(self, context: Context, config: AstrBotConfig = None):
+        # 构造函数不做任何文件读写，数据在后台或首次使用时由 _ensure_ready() 异步加载
+        started = time.perf_counter()
         super().__init__(context)
         self.diary_file = DIARY_JSON_FILE
-        self.summary_cache_file = SUMMARY_CACHE_FILE
-        self.original_backup_dir = ORIGINAL_BACKUP_DIR
         self.umo_cache_file = UMO_CACHE_FILE
         self.sent_cache_file = SENT_CACHE_FILE
+        self.global_timeline = DiaryTimeline("global", DATA_DIR, legacy_file=self.diary_file)
+        self._timelines: Dict[str, DiaryTimeline] = {}
+        self._tasks: set = set()
+        self._ready: Optional[asyncio.Future] = None
+        self._inflight: Dict[str, asyncio.Future] = {}
+        self.writer = AtomicFileWriter()
+        self.config = config
+        self._rate_limiters: Dict[str, TokenBucket] = {}
+        self._breakers: Dict[str, CircuitBreaker] = {}
+        self._llm_semaphore: Optional[asyncio.Semaphore] = None
+        self.local_scorer = LexiconEmotionScorer()
+        self.metrics = PipelineMetrics()
+        self._metrics_written_version = 0
+        self.scheduler = DailyScheduler(SCHEDULER_STATE_FILE, self.writer, on_tick=self._on_tick)
+        self._apply_config()
+        self.default_prompt = (f"请生成一篇{{style}}风格的舔狗日记，内容要反映出对心上人爱而不得的痛苦心情，"
+                               f"字数在{{min_word_count}}到{{max_word_count}}字之间。日期为：{{date}}。"
+                               f"请考虑之前的日记内容：{{history}}")
+        self.emotion_threshold = 7
+        self.base_umo = ""
+        self.sent_cache: Dict[str, Any] = {}
+        try:
+            asyncio.get_running_loop()
+        except RuntimeError:
+            logger.info("当前没有运行中的事件循环，舔狗日记数据将在首次使用时加载")
+        else:
+            self._track(self._preload())
+        logger.info(f"舔狗日记插件已创建，耗时 {(time.perf_counter() - started) * 1000:.1f} ms")
+
+    def _track(self, coro) -> asyncio.Future:
+        # 记录后台任务句柄，卸载或重载插件时统一取消，避免残留重复的任务
+        task = asyncio.ensure_future(coro)
+        self._tasks.add(task)
+        task.add_done_callback(self._tasks.discard)
+        return task
+
+    async def _preload(self):
+        try:
+            await self._ensure_ready()
+        except Exception as e:
+            logger.error(f"后台加载舔狗日记数据时出错，将在首次使用时重试: {e}")
+
+    async def _ensure_ready(self):
+        # 首次调用时在工作线程中加载日记、索引、缓存等数据，并发调用共享同一次加载；加载失败时下次调用重试
+        if self._ready is None:
+            self._ready = asyncio.ensure_future(self._load_data())
+        try:
+            await asyncio.shield(self._ready)
+        except asyncio.CancelledError:
+            raise
+        except Exception:
+            self._ready = None
+            raise
+
+    async def _load_data(self):
+        started = time.perf_counter()
+        await asyncio.to_thread(self._load_data_sync)
+        logger.info(f"舔狗日记数据加载完成，耗时 {(time.perf_counter() - started) * 1000:.1f} ms，"
+                    f"共 {len(self.global_timeline.store)} 篇日记")
+        self.scheduler.start()
+        logger.info(f"启动舔狗日记自动生成定时任务，时间设置为 {self.auto_generate_time}")
+        logger.info(f"启动舔狗日记自动发送定时任务，时间设置为 {self.auto_send_time}，发送群组: {self.auto_send_groups}")
+        logger.info(f"转发阈值设置为 {self.forward_threshold} 字")
+
+    def _load_data_sync(self):
         self._ensure_data_directory()
-        self._initialize_files()
+        self.global_timeline.open()
+        self.base_umo = self._load_base_umo()
+        self.sent_cache = self._load_sent_cache()
+
+    def _apply_config(self):
+        # 每次调度检查时重新读取配置，修改生成/发送时间、群组等无需重启插件
+        config = self.config
         self.min_word_count = config.get("dogdiary_min_word_count", 150) if config else 150
         self.max_word_count = config.get("dogdiary_max_word_count", 300) if config else 300
         self.diary_style = config.get("dogdiary_style", "幽默自嘲") if config else "幽默自嘲"
         self.auto_generate_time = config.get("dogdiary_auto_generate_time", "08:00") if config else "08:00"
         self.auto_send_time = config.get("dogdiary_auto_send_time", "09:00") if config else "09:00"
+        self.warmup_time = config.get("dogdiary_warmup_time", "04:00") if config else "04:00"
         self.auto_send_groups = [str(gid) for gid in config.get("dogdiary_auto_send_groups", [])] if config else []
         self.forward_threshold = config.get("dogdiary_forward_threshold", 200) if config else 200
-        self.default_prompt = (f"请生成一篇{{style}}风格的舔狗日记，内容要反映出对心上人爱而不得的痛苦心情，"
-                               f"字数在{{min_word_count}}到{{max_word_count}}字之间。日期为：{{date}}。"
-                               f"请考虑之前的日记内容：{{history}}")
-        self.summary_cache: Dict[str, str] = self._load_summary_cache()
-        self.emotion_threshold = 7
-        self.base_umo = self._load_base_umo()
-        self.sent_cache = self._load_sent_cache()
-        asyncio.create_task(self._daily_diary_task())
-        asyncio.create_task(self._daily_send_task())
-        logger.info(f"启动舔狗日记自动生成定时任务，时间设置为 {self.auto_generate_time}")
-        logger.info(f"启动舔狗日记自动发送定时任务，时间设置为 {self.auto_send_time}，发送群组: {self.auto_send_groups}")
-        logger.info(f"转发阈值设置为 {self.forward_threshold} 字")
+        self.list_page_size = max(1, config.get("dogdiary_list_page_size", 20) if config else 20)
+        self.summary_concurrency = max(1, config.get("dogdiary_summary_concurrency", 4) if config else 4)
+        self.summary_timeout = config.get("dogdiary_summary_timeout", 30) if config else 30
+        self.history_max_chars = config.get("dogdiary_history_max_chars", 4000) if config else 4000
+        self.structured_output = config.get("dogdiary_structured_output", True) if config else True
+        self.emotion_scorer = config.get("dogdiary_emotion_scorer", "llm") if config else "llm"
+        send_concurrency = max(1, config.get("dogdiary_send_concurrency", 5) if config else 5)
+        send_rate = config.get("dogdiary_send_rate", 1.0) if config else 1.0
+        if (send_concurrency, send_rate) != (getattr(self, "send_concurrency", None), getattr(self, "send_rate", None)):
+            self._rate_limiters.clear()
+        self.send_concurrency = send_concurrency
+        self.send_rate = send_rate
+        self.send_timeout = config.get("dogdiary_send_timeout", 20) if config else 20
+        self.send_retries = max(0, config.get("dogdiary_send_retries", 2) if config else 2)
+        self.group_timelines = config.get("dogdiary_group_timelines", False) if config else False
+        self.group_overrides = self._parse_group_overrides(config.get("dogdiary_group_overrides", []) if config else [])
+        llm_concurrency = max(1, config.get("dogdiary_llm_concurrency", 4) if config else 4)
+        if llm_concurrency != getattr(self, "llm_concurrency", None):
+            self._llm_semaphore = asyncio.Semaphore(llm_concurrency)
+        self.llm_concurrency = llm_concurrency
+        self.llm_timeout = config.get("dogdiary_llm_timeout", 60) if config else 60
+        self.llm_retries = max(0, config.get("dogdiary_llm_retries", 1) if config else 1)
+        self.hedge_provider_id = config.get("dogdiary_hedge_provider", "") if config else ""
+        self.hedge_delay = config.get("dogdiary_hedge_delay", 15) if config else 15
+        self.metrics_file_enabled = config.get("dogdiary_metrics_file", False) if config else False
+        self.streaming = config.get("dogdiary_streaming", False) if config else False
+        self.stream_chunk_chars = max(20, config.get("dogdiary_stream_chunk_chars", 150) if config else 150)
+        for timeline in self._timelines.values():
+            timeline.style = self._override_for_umo(timeline.key).get("style")
+        self._sync_scheduler_jobs()
+
+    def _on_tick(self):
+        self._apply_config()
+        if self.metrics_file_enabled and self.metrics.version != self._metrics_written_version:
+            self._metrics_written_version = self.metrics.version
+            self._track(self._write_metrics_file())
+
+    async def _write_metrics_file(self):
+        try:
+            await self.writer.write_text(METRICS_FILE, "【舔狗日记运行指标】\n" + self.metrics.report() + "\n")
+        except Exception as e:
+            logger.error(f"写入指标文件时出错: {e}")
+
+    @staticmethod
+    def _parse_group_overrides(lines: List[str]) -> Dict[str, Dict[str, str]]:
+        # 每行格式：群号|风格|生成时间|发送时间，留空的字段使用全局配置
+        overrides = {}
+        for line in lines:
+            fields = [field.strip() for field in str(line).split("|")]
+            if not fields[0]:
+                continue
+            fields += [""] * (4 - len(fields))
+            overrides[fields[0]] = {
+                key: value for key, value in zip(("style", "generate_time", "send_time"), fields[1:4]) if value
+            }
+        return overrides
+
+    def _override_for_umo(self, umo: str) -> Dict[str, str]:
+        if not self.group_timelines:
+            return {}
+        return self.group_overrides.get(umo.split(":")[-1], {})
+
+    def _sync_scheduler_jobs(self):
+        # 未开启分群时间线时只有全局的生成/发送两个任务；开启后按各群生效的时间分组，每个时间点一个任务。
+        # 历史记录预热任务在两种模式下都只有一个
+        jobs = {"warmup": (lambda: self.warmup_time, self._warm_up_history)} if self.warmup_time else {}
+        if not self.group_timelines:
+            jobs["generate"] = (lambda: self.auto_generate_time, lambda: self._auto_generate_for_groups(None))
+            jobs["send"] = (lambda: self.auto_send_time, lambda: self._broadcast_today_diary(self.auto_send_groups))
+        else:
+            slots: Dict[Tuple[str, str], List[str]] = {}
+            for gid in self.auto_send_groups:
+                override = self.group_overrides.get(gid, {})
+                slots.setdefault(("generate", override.get("generate_time", self.auto_generate_time)), []).append(gid)
+                slots.setdefault(("send", override.get("send_time", self.auto_send_time)), []).append(gid)
+            for (kind, trigger_time), groups in sorted(slots.items()):
+                default_time = self.auto_generate_time if kind == "generate" else self.auto_send_time
+                name = kind if trigger_time == default_time else f"{kind}@{trigger_time}"
+                func = self._auto_generate_for_groups if kind == "generate" else self._broadcast_today_diary
+                jobs[name] = (lambda t=trigger_time: t, lambda f=func, g=tuple(groups): f(list(g)))
+        self.scheduler.set_jobs(jobs)
 
     def _ensure_data_directory(self):
         data_dir = DIARY_JSON_FILE.parent
         if not data_dir.exists():
             data_dir.mkdir(parents=True, exist_ok=True)
-        if not self.original_backup_dir.exists():
-            self.original_backup_dir.mkdir(parents=True, exist_ok=True)
-
-    def _initialize_files(self):
-        try:
-            if not self.diary_file.exists():
-                with open(self.diary_file, 'w', encoding='utf-8') as f:
-                    json.dump({}, f, ensure_ascii=False, indent=4)
-            if not self.summary_cache_file.exists():
-                with open(self.summary_cache_file, 'w', encoding='utf-8') as f:
-                    json.dump({}, f, ensure_ascii=False, indent=4)
-            if not self.umo_cache_file.exists():
-                with open(self.umo_cache_file, 'w', encoding='utf-8') as f:
-                    json.dump({}, f, ensure_ascii=False, indent=4)
-            if not self.sent_cache_file.exists():
-                with open(self.sent_cache_file, 'w', encoding='utf-8') as f:
-                    json.dump({}, f, ensure_ascii=False, indent=4)
-        except Exception as e:
-            logger.error(f"初始化文件时出错: {e}")
 
-    def _load_diaries(self) -> Dict[str, Any]:
+    async def _get_timeline(self, umo: str = "") -> DiaryTimeline:
+        # 未开启分群时间线或无法确定会话时使用全局时间线；分片在首次使用时于工作线程中打开
+        await self._ensure_ready()
+        if not self.group_timelines or not umo:
+            timeline = self.global_timeline
+        else:
+            timeline = self._timelines.get(umo)
+            if timeline is None:
+                timeline = await self._single_flight(f"open_{umo}", lambda: self._open_timeline(umo))
+        if timeline.store.changed_on_disk():
+            # 日记日志在外部被修改时在工作线程中重新加载，不阻塞事件循环
+            await asyncio.to_thread(timeline.refresh)
+        return timeline
+
+    async def _get_group_timelines(self, groups: List[str]) -> List[DiaryTimeline]:
+        # 并发打开各群的时间线分片（冷启动需要加载存储、全文索引和原文归档），同时打开的分片数有上限
+        semaphore = asyncio.Semaphore(TIMELINE_OPEN_CONCURRENCY)
+
+        async def get(gid: str) -> DiaryTimeline:
+            async with semaphore:
+                return await self._get_timeline(self._construct_umo_for_group(gid))
+
+        return list(await asyncio.gather(*(get(gid) for gid in groups)))
+
+    async def _open_timeline(self, umo: str) -> DiaryTimeline:
+        shard_name = re.sub(r"[^\w.-]", "_", umo)
+        timeline = DiaryTimeline(umo, TIMELINES_DIR / shard_name)
+        await asyncio.to_thread(timeline.open)
+        timeline.style = self._override_for_umo(umo).get("style")
+        self._timelines[umo] = timeline
+        logger.info(f"已打开会话 {umo} 的日记时间线，共 {len(timeline.store)} 篇日记")
+        return timeline
+
+    def _load_diary(self, timeline: DiaryTimeline, date_str: str) -> Optional[Dict[str, Any]]:
         try:
-            with open(self.diary_file, 'r', encoding='utf-8') as f:
-                return json.load(f)
+            with self.metrics.span("load"):
+                return timeline.store.get(date_str)
         except Exception as e:
-            logger.error(f"加载日记文件时出错: {e}")
-            return {}
+            logger.error(f"加载日记时出错 (日期: {date_str}): {e}")
+            return None
 
-    def _save_diaries(self, diaries: Dict[str, Any]):
+    async def _save_diary(self, timeline: DiaryTimeline, date_str: str, entry: Dict[str, Any]) -> bool:
         try:
-            with open(self.diary_file, 'w', encoding='utf-8') as f:
-                json.dump(diaries, f, ensure_ascii=False, indent=4)
+            with self.metrics.span("save"):
+                await asyncio.to_thread(timeline.save_entries, {date_str: entry})
         except Exception as e:
-            logger.error(f"保存日记文件时出错: {e}")
-
-    def _load_summary_cache(self) -> Dict[str, str]:
+            logger.error(f"保存日记时出错 (日期: {date_str}): {e}")
+            return False
         try:
-            with open(self.summary_cache_file, 'r', encoding='utf-8') as f:
-                return json.load(f)
+            await asyncio.to_thread(timeline.search_index.add, date_str, entry['content'])
         except Exception as e:
-            logger.error(f"加载总结缓存文件时出错: {e}")
-            return {}
+            logger.error(f"更新全文索引时出错 (日期: {date_str}): {e}")
+        timeline.schedule_compaction()
+        timeline.mark_history_dirty(date_str)
+        return True
 
-    def _save_summary_cache(self, cache: Dict[str, str]):
+    async def _save_summary_cache(self, timeline: DiaryTimeline):
         try:
-            with open(self.summary_cache_file, 'w', encoding='utf-8') as f:
-                json.dump(cache, f, ensure_ascii=False, indent=4)
+            await self.writer.write_json(timeline.summary_cache_file, timeline.summary_cache)
         except Exception as e:
             logger.error(f"保存总结缓存文件时出错: {e}")
 
@@ -109,14 +1484,15 @@ class LickDogDiaryPlugin(Star):
             with open(self.umo_cache_file, 'r', encoding='utf-8') as f:
                 data = json.load(f)
                 return data.get("base_umo", "")
+        except FileNotFoundError:
+            return ""
         except Exception as e:
             logger.error(f"加载基础 UMO 缓存文件时出错: {e}")
             return ""
 
-    def _save_base_umo(self, umo: str):
+    async def _save_base_umo(self, umo: str):
         try:
-            with open(self.umo_cache_file, 'w', encoding='utf-8') as f:
-                json.dump({"base_umo": umo}, f, ensure_ascii=False, indent=4)
+            await self.writer.write_json(self.umo_cache_file, {"base_umo": umo})
             self.base_umo = umo
             logger.info("已更新并保存基础 unified_msg_origin 缓存。")
         except Exception as e:
@@ -130,310 +1506,651 @@ class LickDogDiaryPlugin(Star):
             return f"{parts[0]}:GroupMessage:{group_id}"
         return self.base_umo
 
-    def _load_sent_cache(self) -> Dict[str, str]:
+    def _load_sent_cache(self) -> Dict[str, Any]:
         try:
             with open(self.sent_cache_file, 'r', encoding='utf-8') as f:
                 return json.load(f)
+        except FileNotFoundError:
+            return {}
         except Exception as e:
             logger.error(f"加载已发送记录缓存文件时出错: {e}")
             return {}
 
-    def _save_sent_cache(self, cache: Dict[str, str]):
+    async def _save_sent_cache(self, cache: Dict[str, Any]):
         try:
-            with open(self.sent_cache_file, 'w', encoding='utf-8') as f:
-                json.dump(cache, f, ensure_ascii=False, indent=4)
+            await self.writer.write_json(self.sent_cache_file, cache)
             self.sent_cache = cache
-            logger.info("已更新已发送记录缓存。")
+            logger.debug("已更新已发送记录缓存。")
         except Exception as e:
             logger.error(f"保存已发送记录缓存文件时出错: {e}")
 
-    def _backup_original_diary(self, date_str: str, time_str: str, content: str):
+    async def _backup_original_diary(self, timeline: DiaryTimeline, date_str: str, time_str: str, content: str):
         try:
-            backup_file = self.original_backup_dir / f"diary_{date_str}.txt"
-            with open(backup_file, 'w', encoding='utf-8') as f:
-                f.write(f"【舔狗日记 - {time_str}】\n{content}\n")
-            logger.info(f"已备份日记原文: {date_str}")
+            with self.metrics.span("backup"):
+                await asyncio.to_thread(timeline.originals.append, date_str, time_str, content)
+            logger.info(f"已备份日记原文: {date_str} (第 {timeline.originals.versions(date_str)} 版)")
         except Exception as e:
             logger.error(f"备份日记原文时出错 (日期: {date_str}): {e}")
 
-    def _load_original_diary(self, date_str: str) -> str:
+    def _load_original_diary(self, timeline: DiaryTimeline, date_str: str, version: int = -1) -> str:
         try:
-            backup_file = self.original_backup_dir / f"diary_{date_str}.txt"
-            if backup_file.exists():
-                with open(backup_file, 'r', encoding='utf-8') as f:
-                    return f.read()
-            return ""
+            record = timeline.originals.load(date_str, version)
+            if record is None:
+                return ""
+            return f"【舔狗日记 - {record['time']}】\n{record['content']}\n"
         except Exception as e:
             logger.error(f"加载日记原文时出错 (日期: {date_str}): {e}")
             return ""
 
+    async def _text_chat(self, prompt: str, site: str, timeout: Optional[float] = None, retries: Optional[int] = None):
+        # 所有 LLM 调用的统一入口：全局并发上限、单次超时、抖动退避重试、备用提供商对冲请求和按调用位置熔断。
+        # site 为调用位置（diary / emotion / summary），分别统计和熔断；timeout 和 retries 默认为 llm_timeout 和 llm_retries
+        timeout = self.llm_timeout if timeout is None else timeout
+        retries = self.llm_retries if retries is None else retries
+        self.metrics.incr(f"llm_calls.{site}")
+        self.metrics.incr(f"prompt_chars.{site}", len(prompt))
+        breaker = self._breakers.setdefault(site, CircuitBreaker())
+        last_error: Optional[BaseException] = None
+        for attempt in range(retries + 1):
+            if attempt:
+                backoff = min(30, 2 ** attempt) * random.uniform(0.5, 1.5)
+                self.metrics.incr(f"llm_retries.{site}")
+                logger.info(f"{backoff:.1f} 秒后第 {attempt} 次重试 LLM 调用 ({site})")
+                await asyncio.sleep(backoff)
+            try:
+                async with self._llm_semaphore:
+                    llm_response = await self._call_providers(prompt, site, breaker, timeout)
+            except asyncio.CancelledError:
+                raise
+            except Exception as e:
+                last_error = e
+                logger.warning(f"LLM 调用失败 ({site}, 第 {attempt + 1} 次): {e!r}")
+                if breaker.state == "open" and self._get_hedge_provider() is None:
+                    break
+                continue
+            self.metrics.incr(f"response_chars.{site}", len(llm_response.completion_text or ""))
+            return llm_response
+        self.metrics.incr(f"llm_errors.{site}")
+        if isinstance(last_error, LLMResponseError):
+            return last_error.response
+        raise last_error
+
+    async def _call_providers(self, prompt: str, site: str, breaker: CircuitBreaker, timeout: float):
+        alternate = self._get_hedge_provider()
+        if not breaker.allow():
+            # 当前提供商已熔断：有备用提供商时直接改用备用提供商，否则立即失败
+            self.metrics.incr(f"llm_circuit_open.{site}")
+            if alternate is None:
+                raise RuntimeError(f"LLM 调用 ({site}) 已熔断，{breaker.cooldown:.0f} 秒内不再请求当前提供商")
+            llm_response = await asyncio.wait_for(self._request(alternate, prompt), timeout=timeout)
+            if llm_response.role != "assistant":
+                raise LLMResponseError(llm_response)
+            return llm_response
+
+        loop = asyncio.get_running_loop()
+        deadline = loop.time() + timeout
+        primary = asyncio.ensure_future(self._request(self.context.get_using_provider(), prompt))
+        pending = {primary}
+        fallback, last_error = None, None
+        primary_recorded = False
+        try:
+            if alternate is not None and self.hedge_delay < timeout:
+                done, _ = await asyncio.wait(pending, timeout=self.hedge_delay)
+                if not done:
+                    # 主提供商响应过慢：向备用提供商发出对冲请求，取先成功返回的结果
+                    self.metrics.incr(f"llm_hedged.{site}")
+                    logger.info(f"LLM 调用 ({site}) 超过 {self.hedge_delay} 秒未返回，向备用提供商发送对冲请求")
+                    pending.add(asyncio.ensure_future(self._request(alternate, prompt)))
+            while pending:
+                remaining = deadline - loop.time()
+                if remaining <= 0:
+                    break
+                done, pending = await asyncio.wait(pending, timeout=remaining, return_when=asyncio.FIRST_COMPLETED)
+                for task in done:
+                    error = task.exception()
+                    if task is primary:
+                        # 返回错误响应（role 不是 assistant）同样计为失败
+                        breaker.record(error is None and task.result().role == "assistant")
+                        primary_recorded = True
+                    if error is not None:
+                        last_error = error
+                    elif task.result().role == "assistant":
+                        return task.result()
+                    else:
+                        fallback = task.result()
+        finally:
+            if not primary_recorded:
+                # 对冲请求先返回、超过截止时间或调用被取消时主请求仍未完成，计为一次失败；
+                # 半开状态下的试探请求必须有结果，否则熔断器会一直停在半开状态
+                breaker.record(primary.done() and not primary.cancelled() and primary.exception() is None
+                               and primary.result().role == "assistant")
+            for task in pending:
+                task.cancel()
+        if fallback is not None:
+            raise LLMResponseError(fallback)
+        if last_error is not None and not pending:
+            raise last_error
+        raise asyncio.TimeoutError(f"LLM 调用 ({site}) 超过 {timeout} 秒未返回")
+
+    def _get_hedge_provider(self):
+        if not self.hedge_provider_id:
+            return None
+        return self.context.get_provider_by_id(self.hedge_provider_id)
+
+    @staticmethod
+    async def _request(provider, prompt: str):
+        if provider is None:
+            raise RuntimeError("未找到可用的 LLM 提供商")
+        return await provider.text_chat(
+            prompt=prompt,
+            contexts=[],
+            func_tool=None
+        )
+
+    async def _stream_text(self, prompt: str, site: str):
+        # 流式 LLM 调用：逐段产出回复文本。提供商不支持流式输出、当前已熔断，或在产出任何内容前出错时，
+        # 回退为 _text_chat 的普通调用（含重试和对冲）；已产出部分内容后出错则直接抛出，避免重复发送
+        provider = self.context.get_using_provider()
+        breaker = self._breakers.setdefault(site, CircuitBreaker())
+        if provider is not None and hasattr(provider, "text_chat_stream") and breaker.state == "closed":
+            self.metrics.incr(f"llm_calls.{site}")
+            self.metrics.incr(f"prompt_chars.{site}", len(prompt))
+            received = 0
+            try:
+                async for text in self._iter_stream(provider, prompt):
+                    received += len(text)
+                    yield text
+                breaker.record(True)
+                self.metrics.incr(f"response_chars.{site}", received)
+                if received:
+                    return
+                logger.warning(f"流式 LLM 调用 ({site}) 未返回内容，回退为普通调用")
+            except asyncio.CancelledError:
+                raise
+            except Exception as e:
+                breaker.record(False)
+                if received:
+                    self.metrics.incr(f"llm_errors.{site}")
+                    raise
+                logger.warning(f"流式 LLM 调用失败 ({site}): {e!r}，回退为普通调用")
+        llm_response = await self._text_chat(prompt, site)
+        if llm_response.role == "assistant" and llm_response.completion_text:
+            yield llm_response.completion_text
+
+    async def _iter_stream(self, provider, prompt: str):
+        # 增量块 (is_chunk) 直接产出，流末尾的完整响应只补上尚未收到的部分；相邻两块间隔超过 llm_timeout 秒视为超时。
+        # 只在读取每一块时占用全局 LLM 并发名额，产出（发送给平台）期间不占用，调用方中途放弃也不会一直占着名额
+        stream = provider.text_chat_stream(prompt=prompt, contexts=[], func_tool=None)
+        received: List[str] = []
+        try:
+            while True:
+                try:
+                    async with self._llm_semaphore:
+                        response = await asyncio.wait_for(stream.__anext__(), timeout=self.llm_timeout)
+                except StopAsyncIteration:
+                    return
+                if response.role == "err":
+                    raise RuntimeError(response.completion_text or "LLM 返回错误")
+                text = response.completion_text or ""
+                if not getattr(response, "is_chunk", True):
+                    so_far = "".join(received)
+                    text = text[len(so_far):] if text.startswith(so_far) else ("" if so_far else text)
+                if text:
+                    received.append(text)
+                    yield text
+        finally:
+            with contextlib.suppress(Exception):
+                await stream.aclose()
+
+    async def _chunk_stream(self, pieces):
+        # 把流式增量合并成适合逐条发送的段落：攒够 stream_chunk_chars 字后在最近的换行或句末标点处切分，
+        # 迟迟没有标点时攒到两倍长度直接切
+        buffer = ""
+        async for piece in pieces:
+            buffer += piece
+            while len(buffer) >= self.stream_chunk_chars:
+                cut = max(buffer.rfind(mark) for mark in STREAM_BREAK_MARKS) + 1
+                if cut < self.stream_chunk_chars // 2:
+                    if len(buffer) < self.stream_chunk_chars * 2:
+                        break
+                    cut = len(buffer)
+                chunk, buffer = buffer[:cut], buffer[cut:]
+                if chunk.strip():
+                    yield chunk
+        if buffer.strip():
+            yield buffer
+
     async def _analyze_emotion_intensity(self, content: str) -> int:
+        with self.metrics.span("emotion"):
+            return await self._score_emotion(content)
+
+    async def _score_emotion(self, content: str) -> int:
+        if self.emotion_scorer == "local":
+            return self.local_scorer.score(content)
         try:
             prompt = f"分析以下文本的情感强度（评分 1-10 分，1 表示情感极弱，10 表示情感极强），仅返回一个数字：\n{content[:500]}"
-            llm_response = await self.context.get_using_provider().text_chat(
-                prompt=prompt,
-                contexts=[],
-                func_tool=None
-            )
+            llm_response = await self._text_chat(prompt, "emotion")
             if llm_response.role == "assistant":
                 response_text = llm_response.completion_text.strip()
-                try:
-                    score = int(response_text)
-                    if 1 <= score <= 10:
-                        return score
-                except ValueError:
-                    logger.error(f"LLM 返回的情感强度评分无效: {response_text}")
-            return 0
+                match = re.search(r"\d+", response_text)
+                if match and 1 <= int(match.group()) <= 10:
+                    return int(match.group())
+                logger.error(f"LLM 返回的情感强度评分无效: {response_text}，改用本地评分")
         except Exception as e:
-            logger.error(f"分析情感强度时出错: {e}")
-            return 0
+            logger.error(f"分析情感强度时出错: {e}，改用本地评分")
+        return self.local_scorer.score(content)
 
-    async def _daily_diary_task(self):
-        logger.info(f"启动舔狗日记自动生成定时任务，时间设置为 {self.auto_generate_time}")
-        while True:
+    def _build_date_info(self, day: Optional[date] = None) -> str:
+        day = day or datetime.now()
+        current_time = day.strftime("%Y-%m-%d")
+        weekday = day.strftime("%w")
+        weather = random.choice(['☀️', '🌥', '🌧', '🌪'])
+        weekdays = ['日', '一', '二', '三', '四', '五', '六']
+        weekday_cn = weekdays[int(weekday)]
+        return f"{current_time} {weather}周{weekday_cn}"
+
+    def _build_prompt(self, timeline: DiaryTimeline, date_info: str, history: str) -> str:
+        return self.default_prompt.format(
+            style=timeline.style or self.diary_style,
+            min_word_count=self.min_word_count,
+            max_word_count=self.max_word_count,
+            date=date_info,
+            history=history if history else '暂无历史记录'
+        )
+
+    async def _generate_diary_text(self, prompt: str, score_emotion: bool = True) -> Optional[Tuple[str, Optional[int]]]:
+        # 返回 (日记正文, 情感强度评分)，LLM 响应无效时返回 None；
+        # score_emotion 为 False 时不单独分析情感强度，结构化输出未带评分时评分为 None，由调用方另行分析
+        structured = self.structured_output and self.emotion_scorer == "llm"
+        if structured:
+            prompt += STRUCTURED_OUTPUT_INSTRUCTION
+        with self.metrics.span("generate"):
+            llm_response = await self._text_chat(prompt, "diary")
+        if llm_response.role != "assistant":
+            return None
+        completion = llm_response.completion_text.strip()
+        if structured:
+            parsed = self._parse_structured_diary(completion)
+            if parsed:
+                return parsed
+            logger.warning("结构化日记输出解析失败，回退为单独的情感强度分析")
+            completion = self._extract_diary_field(completion)
+        if not score_emotion:
+            return completion, None
+        return completion, await self._analyze_emotion_intensity(completion)
+
+    @staticmethod
+    def _parse_structured_diary(completion: str) -> Optional[Tuple[str, int]]:
+        start, end = completion.find("{"), completion.rfind("}")
+        if start < 0 or end <= start:
+            return None
+        try:
+            data = json.loads(completion[start:end + 1])
+            content = data["diary"].strip()
+            score = int(data["emotion_score"])
+        except (ValueError, KeyError, TypeError, AttributeError):
+            return None
+        if not content or not 1 <= score <= 10:
+            return None
+        return content, score
+
+    @staticmethod
+    def _extract_diary_field(completion: str) -> str:
+        # 输出不是合法 JSON 时尽量取出 diary 字段的文本，取不到则把整段输出当作日记正文
+        match = re.search(r'"diary"\s*:\s*"((?:[^"\\]|\\.)*)', completion, re.S)
+        if match:
             try:
-                now = datetime.now()
-                hour, minute = map(int, self.auto_generate_time.split(':'))
-                next_trigger = datetime(now.year, now.month, now.day, hour, minute)
-                if now >= next_trigger:
-                    next_trigger += timedelta(days=1)
-                wait_seconds = (next_trigger - now).total_seconds()
-                await asyncio.sleep(wait_seconds)
+                return json.loads(f'"{match.group(1)}"').strip()
+            except ValueError:
+                return match.group(1).strip()
+        return re.sub(r'^```(?:json)?|```$', '', completion).strip()
+
+    async def _generate_entry(self, timeline: DiaryTimeline, label: str) -> Optional[Dict[str, Any]]:
+        time_str = self._build_date_info()
+        with self.metrics.span("history"):
+            previous_diary_summary = await self.summarize_and_forget_diaries(timeline)
+        prompt = self._build_prompt(timeline, time_str, previous_diary_summary)
+        generated = await self._generate_diary_text(prompt)
+        if not generated:
+            logger.error(f"{label}失败，LLM 响应无效")
+            return None
+        diary_content, emotion_score = generated
+        return self._make_entry(label, time_str, diary_content, emotion_score)
+
+    def _make_entry(self, label: str, time_str: str, content: str, emotion_score: int) -> Dict[str, Any]:
+        is_important = emotion_score >= self.emotion_threshold
+        if emotion_score > 0:
+            logger.info(f"{label}情感强度评分: {emotion_score}, 标记为重要: {is_important}")
+        else:
+            logger.warning("情感强度分析失败，默认不标记为重要")
+            is_important = False
+        return {'time': time_str, 'content': content, 'important': is_important, 'emotion_score': emotion_score}
+
+    async def _stream_entry(self, timeline: DiaryTimeline, label: str, result: Dict[str, Any]):
+        # 流式生成日记：边生成边产出正文段落，流结束后再分析情感强度，完整日记写入 result["entry"]。
+        # 流式输出不使用结构化 JSON 格式，情感强度总是单独分析
+        time_str = self._build_date_info()
+        result["time"] = time_str
+        with self.metrics.span("history"):
+            previous_diary_summary = await self.summarize_and_forget_diaries(timeline)
+        prompt = self._build_prompt(timeline, time_str, previous_diary_summary)
+        started = time.perf_counter()
+        parts: List[str] = []
+        async for chunk in self._chunk_stream(self._stream_text(prompt, "diary")):
+            if not parts:
+                self.metrics.record("first_chunk", (time.perf_counter() - started) * 1000)
+            parts.append(chunk)
+            yield chunk
+        self.metrics.record("generate", (time.perf_counter() - started) * 1000)
+        diary_content = "".join(parts).strip()
+        if not diary_content:
+            logger.error(f"{label}失败，LLM 响应无效")
+            return
+        result["entry"] = self._make_entry(label, time_str, diary_content, await self._analyze_emotion_intensity(diary_content))
 
+    async def _stream_diary(self, event: AstrMessageEvent, timeline: DiaryTimeline, title: str, label: str,
+                            save: bool = True, inflight_key: Optional[str] = None):
+        # 交互指令的流式输出：每攒够一段就作为一条消息发出，流结束后再保存日记并补发情感强度。
+        # 给出 inflight_key 时登记为进行中的任务，期间同一 key 的并发请求等待本次生成结果而不重复调用 LLM
+        future = None
+        if inflight_key is not None:
+            future = asyncio.get_running_loop().create_future()
+            self._inflight[inflight_key] = future
+            future.add_done_callback(lambda _: self._inflight.pop(inflight_key, None))
+        result: Dict[str, Any] = {}
+        saved = None
+        try:
+            async for chunk in self._stream_entry(timeline, label, result):
+                if "sent" not in result:
+                    result["sent"] = True
+                    chunk = f"【{title} - {result['time']}】\n{chunk.lstrip()}"
+                yield event.plain_result(chunk.strip())
+            entry = result.get("entry")
+            if entry is None:
+                yield event.plain_result(f"{label}失败，请稍后重试。")
+                return
+            if save:
                 today = date.today().isoformat()
-                diaries = self._load_diaries()
-                if today in diaries:
-                    logger.info(f"今天 ({today}) 已生成日记，跳过自动生成")
-                    continue
+                if not await self._save_diary(timeline, today, entry):
+                    yield event.plain_result("保存日记失败，请稍后重试。")
+                    return
+                await self._backup_original_diary(timeline, today, entry['time'], entry['content'])
+                saved = entry
+            if entry['emotion_score'] > 0:
+                yield event.plain_result(f"(情感强度: {entry['emotion_score']}/10)")
+        except Exception as e:
+            logger.error(f"流式{label}时出错: {e}")
+            yield event.plain_result(f"{label}时发生错误，请稍后重试。")
+        finally:
+            if future is not None and not future.done():
+                future.set_result(saved)
 
-                current_time = datetime.now().strftime("%Y-%m-%d")
-                weekday = datetime.now().strftime("%w")
-                weather = random.choice(['☀️', '🌥', '🌧', '🌪'])
-                weekdays = ['日', '一', '二', '三', '四', '五', '六']
-                weekday_cn = weekdays[int(weekday)]
-                date_info = f"{current_time} {weather}周{weekday_cn}"
+    async def _single_flight(self, key: str, factory):
+        # 同一 key 的并发请求共享同一个进行中的任务，只调用一次 LLM、只写一次存储
+        task = self._inflight.get(key)
+        if task is None:
+            task = asyncio.ensure_future(factory())
+            self._inflight[key] = task
+            task.add_done_callback(lambda _: self._inflight.pop(key, None))
+        else:
+            logger.info(f"合并并发请求，等待进行中的任务: {key}")
+        return await asyncio.shield(task)
 
-                previous_diary_summary = await self.summarize_and_forget_diaries(diaries)
+    async def _create_today_diary(self, timeline: DiaryTimeline) -> Optional[Dict[str, Any]]:
+        today = date.today().isoformat()
+        diary = self._load_diary(timeline, today)
+        if diary is not None:
+            return diary
+        entry = await self._generate_entry(timeline, "日记")
+        if entry is None or not await self._save_diary(timeline, today, entry):
+            return None
+        await self._backup_original_diary(timeline, today, entry['time'], entry['content'])
+        logger.info(f"生成今日日记成功: {today} ({timeline.key})")
+        return entry
 
-                prompt = self.default_prompt.format(
-                    style=self.diary_style,
-                    min_word_count=self.min_word_count,
-                    max_word_count=self.max_word_count,
-                    date=date_info,
-                    history=previous_diary_summary if previous_diary_summary else '暂无历史记录'
-                )
+    async def _get_today_diary(self, timeline: DiaryTimeline) -> Optional[Dict[str, Any]]:
+        today = date.today().isoformat()
+        return await self._single_flight(f"diary_{timeline.key}_{today}", lambda: self._create_today_diary(timeline))
 
-                try:
-                    llm_response = await self.context.get_using_provider().text_chat(
-                        prompt=prompt,
-                        contexts=[],
-                        func_tool=None
-                    )
-                    if llm_response.role == "assistant":
-                        diary_content = llm_response.completion_text.strip()
-                        time_str = f"{current_time} {weather}周{weekday_cn}"
-                        emotion_score = await self._analyze_emotion_intensity(diary_content)
-                        is_important = emotion_score >= self.emotion_threshold
-                        if emotion_score > 0:
-                            logger.info(f"自动生成日记情感强度评分: {emotion_score}, 标记为重要: {is_important}")
-                        else:
-                            logger.warning("情感强度分析失败，默认不标记为重要")
-                            is_important = False
-                        diaries[today] = {'time': time_str, 'content': diary_content, 'important': is_important, 'emotion_score': emotion_score}
-                        self._save_diaries(diaries)
-                        self._backup_original_diary(today, time_str, diary_content)
-                        logger.info(f"自动生成日记成功: {today}")
-                    else:
-                        logger.error("自动生成日记失败，LLM 响应无效")
-                except Exception as e:
-                    logger.error(f"自动生成日记时出错: {e}")
-            except Exception as e:
-                logger.error(f"自动生成日记任务异常: {e}")
-            await asyncio.sleep(3600)  # 发生异常时等待1小时后重试
+    async def _auto_generate_diary(self, timeline: DiaryTimeline) -> bool:
+        today = date.today().isoformat()
+        if today in timeline.store:
+            logger.info(f"今天 ({today}) 已生成日记，跳过自动生成 ({timeline.key})")
+            return True
+        try:
+            return await self._get_today_diary(timeline) is not None
+        except Exception as e:
+            logger.error(f"自动生成日记时出错 ({timeline.key}): {e}")
+            return False
+
+    async def _auto_generate_for_groups(self, groups: Optional[List[str]]) -> bool:
+        # groups 为 None 时生成全局日记；开启分群时间线时为每个群各自生成
+        if groups is None or not self.group_timelines:
+            return await self._auto_generate_diary(self.global_timeline)
+        if not self.base_umo:
+            logger.warning("未找到基础 unified_msg_origin，无法为各群生成日记，请先发送 '舔狗日记' 指令初始化。")
+            return False
+        timelines = await self._get_group_timelines(groups)
+        results = await asyncio.gather(*(self._auto_generate_diary(timeline) for timeline in timelines))
+        return all(results)
+
+    def _get_delivery_ledger(self, sent_cache: Dict[str, Any], current_day: str) -> Dict[str, Dict[str, Any]]:
+        deliveries = sent_cache.setdefault("deliveries", {})
+        # 只保留最近几天的发送记录
+        for day in sorted(deliveries)[:-DELIVERY_LEDGER_DAYS]:
+            if day != current_day:
+                del deliveries[day]
+        ledger = deliveries.setdefault(current_day, {})
+        # 兼容旧格式：群号 -> 发送时间
+        for gid, record in list(ledger.items()):
+            if isinstance(record, str):
+                ledger[gid] = {"status": "sent", "attempts": 1, "latency_ms": 0, "path": "nodes", "updated": record}
+        # 旧版本只记录 last_sent_date，视为当天所有群组都已发送
+        if sent_cache.pop("last_sent_date", None) == current_day and not ledger:
+            for gid in self.auto_send_groups:
+                ledger[gid] = {"status": "sent", "attempts": 1, "latency_ms": 0, "path": "nodes", "updated": current_day}
+        return ledger
 
-    async def _daily_send_task(self):
-        logger.info(f"启动舔狗日记自动发送定时任务，时间设置为 {self.auto_send_time}")
+    def _build_forward_nodes(self, text: str):
         from astrbot.api.message_components import Node, Plain, Nodes  # 导入转发相关组件
-        
-        while True:
-            try:
-                now = datetime.now()
-                current_day = now.strftime("%Y-%m-%d")
-                hour, minute = map(int, self.auto_send_time.split(':'))
-                next_trigger = datetime(now.year, now.month, now.day, hour, minute)
-                if now >= next_trigger:
-                    next_trigger += timedelta(days=1)
-                wait_seconds = (next_trigger - now).total_seconds()
-                await asyncio.sleep(wait_seconds)
-
-                if not self.auto_send_groups:
-                    logger.info("未设置自动发送的群组，跳过发送任务")
-                    continue
 
-                today = date.today().isoformat()
-                diaries = self._load_diaries()
-                if today not in diaries:
-                    logger.info(f"今天 ({today}) 尚未生成日记，跳过自动发送")
-                    continue
+        # 构造转发消息节点，超长文本按行切分为多个节点，放在同一条转发消息中
+        virtual_uin = 123456789  # 虚拟用户ID，可自定义
+        virtual_name = "舔狗本人"  # 虚拟用户昵称
+        chunks, current = [], ""
+        for line in text.split("\n"):
+            while len(line) > FORWARD_NODE_MAX_CHARS:
+                if current:
+                    chunks.append(current)
+                    current = ""
+                chunks.append(line[:FORWARD_NODE_MAX_CHARS])
+                line = line[FORWARD_NODE_MAX_CHARS:]
+            if current and len(current) + 1 + len(line) > FORWARD_NODE_MAX_CHARS:
+                chunks.append(current)
+                current = line
+            else:
+                current = f"{current}\n{line}" if current else line
+        if current:
+            chunks.append(current)
+        return Nodes(nodes=[Node(uin=virtual_uin, name=virtual_name, content=[Plain(chunk)]) for chunk in chunks])
 
-                sent_cache = self._load_sent_cache()
-                if sent_cache.get("last_sent_date") == current_day:
-                    logger.info(f"今天 ({current_day}) 已发送过日记，跳过自动发送")
-                    continue
+    def _make_result(self, event: AstrMessageEvent, text: str):
+        # 超过转发阈值的内容以合并转发形式发送，避免单条消息过长被平台截断或拒绝
+        if len(text) > self.forward_threshold:
+            return event.chain_result([self._build_forward_nodes(text)])
+        return event.plain_result(text)
 
-                diary_content = diaries[today]['content']
-                time_str = diaries[today]['time']
-                emotion_score = diaries[today].get('emotion_score', 0)
-                result_msg = f"【今日舔狗日记 - {time_str}】\n{diary_content}"
-                if emotion_score > 0:
-                    result_msg += f"\n(情感强度: {emotion_score}/10)"
+    async def _broadcast_today_diary(self, groups: List[str]) -> bool:
+        current_day = datetime.now().strftime("%Y-%m-%d")
+        if not groups:
+            logger.info("未设置自动发送的群组，跳过发送任务")
+            return True
 
-                sent_count = 0
-                if not self.base_umo:
-                    logger.warning("未找到基础 unified_msg_origin，定时发送失败，请先发送 '舔狗日记' 指令初始化。")
-                    continue
+        sent_cache = self.sent_cache
+        ledger = self._get_delivery_ledger(sent_cache, current_day)
+        pending = [gid for gid in groups if ledger.get(gid, {}).get("status") != "sent"]
+        if not pending:
+            logger.info(f"今天 ({current_day}) 已发送过日记，跳过自动发送")
+            return True
 
-                # 构造转发消息节点
-                virtual_uin = 123456789  # 虚拟用户ID，可自定义
-                virtual_name = "舔狗本人"  # 虚拟用户昵称
-                node_content = [Plain(result_msg)]  # 转发内容为日记文本
-                node = Node(uin=virtual_uin, name=virtual_name, content=node_content)
-                nodes = Nodes(nodes=[node])  # 构造转发节点集合
+        if not self.base_umo:
+            logger.warning("未找到基础 unified_msg_origin，定时发送失败，请先发送 '舔狗日记' 指令初始化。")
+            return False
 
-                for group_id in self.auto_send_groups:
-                    constructed_umo = self._construct_umo_for_group(group_id)
-                    try:
-                        logger.info(f"使用构造的 unified_msg_origin 向群组 {group_id} 发送转发消息。")
-                        # 尝试以转发形式发送消息
-                        await self.context.send_message(constructed_umo, nodes)
-                        logger.info(f"成功以转发形式发送日记到群组 {group_id}")
-                        sent_count += 1
-                        await asyncio.sleep(1)  # 防止发送过快被限制
-                    except Exception as e:
-                        logger.error(f"以转发形式发送日记到群组 {group_id} 失败: {e}")
-                        # 回退到普通文本形式发送
-                        try:
-                            message_chain = MessageChain()
-                            message_chain.message(result_msg)
-                            await self.context.send_message(constructed_umo, message_chain)
-                            logger.info(f"回退到普通文本形式，成功发送日记到群组 {group_id}")
-                            sent_count += 1
-                            await asyncio.sleep(1)
-                        except Exception as e2:
-                            logger.error(f"回退普通文本形式发送日记到群组 {group_id} 也失败: {e2}")
-
-                if sent_count == 0:
-                    logger.warning("没有成功发送日记到任何群组，可能是构造的 unified_msg_origin 无效或配置的群组ID有误。")
+        # 每个群读取自己时间线上的今日日记（未开启分群时间线时都是全局日记），尚未生成的群留待重试
+        today = date.today().isoformat()
+        messages: Dict[str, Tuple[Any, str]] = {}
+        for gid, timeline in zip(pending, await self._get_group_timelines(pending)):
+            diary = self._load_diary(timeline, today)
+            if diary is None:
+                continue
+            if timeline.key not in messages:
+                result_msg = f"【今日舔狗日记 - {diary['time']}】\n{diary['content']}"
+                if diary.get('emotion_score', 0) > 0:
+                    result_msg += f"\n(情感强度: {diary['emotion_score']}/10)"
+                messages[timeline.key] = (self._build_forward_nodes(result_msg), result_msg)
+            messages[gid] = messages[timeline.key]
+        waiting = [gid for gid in pending if gid not in messages]
+        if waiting:
+            logger.info(f"今天 ({today}) 以下群组尚未生成日记，稍后重试自动发送: {waiting}")
+        pending = [gid for gid in pending if gid in messages]
+
+        # 已成功的群组不再重复发送，只重试失败或尚未发送的群组
+        if len(pending) + len(waiting) < len(groups):
+            logger.info(f"今天已向 {len(groups) - len(pending) - len(waiting)} 个群组发送过日记，继续发送剩余 {len(pending)} 个群组。")
+
+        semaphore = asyncio.Semaphore(self.send_concurrency)
+
+        async def deliver(group_id: str):
+            async with semaphore:
+                started = time.monotonic()
+                nodes, result_msg = messages[group_id]
+                with self.metrics.span("send"):
+                    path, attempts = await self._send_to_group(group_id, nodes, result_msg)
+                if path:
+                    self.metrics.incr("send_ok")
                 else:
-                    logger.info(f"成功发送日记到 {sent_count}/{len(self.auto_send_groups)} 个群组。")
-                    sent_cache["last_sent_date"] = current_day
-                    self._save_sent_cache(sent_cache)
+                    self.metrics.incr("send_failed")
+                    self.metrics.send_failed(group_id)
+                previous = ledger.get(group_id, {})
+                ledger[group_id] = {
+                    "status": "sent" if path else "failed",
+                    "attempts": previous.get("attempts", 0) + attempts,
+                    "latency_ms": int((time.monotonic() - started) * 1000),
+                    "path": path,
+                    "updated": datetime.now().isoformat(timespec="seconds"),
+                }
+            # 释放发送名额后再落盘，写入器会合并排队中的重复写入
+            await self._save_sent_cache(sent_cache)
+
+        with self.metrics.span("broadcast"):
+            await asyncio.gather(*(deliver(gid) for gid in pending))
+
+        sent_count = sum(1 for gid in groups if ledger.get(gid, {}).get("status") == "sent")
+        if sent_count == 0:
+            logger.warning("没有成功发送日记到任何群组，可能是构造的 unified_msg_origin 无效或配置的群组ID有误。")
+        else:
+            logger.info(f"成功发送日记到 {sent_count}/{len(groups)} 个群组。")
+        if sent_count < len(groups):
+            failed = [gid for gid in groups if ledger.get(gid, {}).get("status") != "sent" and gid not in waiting]
+            if failed:
+                logger.warning(f"以下群组发送失败，稍后仅对这些群组重试: {failed}")
+            return False
+        return True
+
+    async def _send_to_group(self, group_id: str, nodes, result_msg: str) -> Tuple[str, int]:
+        # 返回 (发送方式, 尝试次数)，发送方式为 "nodes"（转发）或 "plain"（普通文本），全部失败时为空字符串
+        constructed_umo = self._construct_umo_for_group(group_id)
+        bucket = self._get_rate_limiter(constructed_umo.split(":")[0])
+        attempts = 0
+        for attempt in range(self.send_retries + 1):
+            attempts += 1
+            if attempt:
+                backoff = min(60, 2 ** attempt) * random.uniform(0.5, 1.5)
+                logger.info(f"{backoff:.1f} 秒后第 {attempt} 次重试发送日记到群组 {group_id}")
+                await asyncio.sleep(backoff)
+            await bucket.acquire()
+            try:
+                logger.info(f"使用构造的 unified_msg_origin 向群组 {group_id} 发送转发消息。")
+                # 尝试以转发形式发送消息
+                await asyncio.wait_for(self.context.send_message(constructed_umo, nodes), timeout=self.send_timeout)
+                logger.info(f"成功以转发形式发送日记到群组 {group_id}")
+                return "nodes", attempts
             except Exception as e:
-                logger.error(f"自动发送日记任务异常: {e}")
-            await asyncio.sleep(3600)  # 发生异常时等待1小时后重试
+                logger.error(f"以转发形式发送日记到群组 {group_id} 失败: {e!r}")
+            # 回退到普通文本形式发送
+            await bucket.acquire()
+            try:
+                message_chain = MessageChain()
+                message_chain.message(result_msg)
+                await asyncio.wait_for(self.context.send_message(constructed_umo, message_chain), timeout=self.send_timeout)
+                logger.info(f"回退到普通文本形式，成功发送日记到群组 {group_id}")
+                return "plain", attempts
+            except Exception as e2:
+                logger.error(f"回退普通文本形式发送日记到群组 {group_id} 也失败: {e2!r}")
+        return "", attempts
+
+    def _get_rate_limiter(self, platform: str) -> "TokenBucket":
+        bucket = self._rate_limiters.get(platform)
+        if bucket is None:
+            bucket = TokenBucket(self.send_rate, max(1, self.send_concurrency))
+            self._rate_limiters[platform] = bucket
+        return bucket
 
     @filter.command("今日舔狗日记")
     async def generate_diary(self, event: AstrMessageEvent):
         today = date.today().isoformat()
+        timeline = await self._get_timeline(event.unified_msg_origin)
         
-        diaries = self._load_diaries()
-        if not diaries and diaries != {}:
-            yield event.plain_result("读取日记文件失败，请稍后重试。")
+        diary = self._load_diary(timeline, today)
+        self.metrics.cache("today", diary is not None)
+        if diary is not None:
+            yield event.plain_result(f"【今日舔狗日记 - {diary['time']}】\n{diary['content']}")
             return
         
-        if today in diaries:
-            yield event.plain_result(f"【今日舔狗日记 - {diaries[today]['time']}】\n{diaries[today]['content']}")
+        inflight_key = f"diary_{timeline.key}_{today}"
+        if self.streaming and inflight_key not in self._inflight:
+            async for result in self._stream_diary(event, timeline, "今日舔狗日记", "生成日记", inflight_key=inflight_key):
+                yield result
             return
         
-        current_time = datetime.now().strftime("%Y-%m-%d")
-        weekday = datetime.now().strftime("%w")
-        weather = random.choice(['☀️', '🌥', '🌧', '🌪'])
-        weekdays = ['日', '一', '二', '三', '四', '五', '六']
-        weekday_cn = weekdays[int(weekday)]
-        date_info = f"{current_time} {weather}周{weekday_cn}"
-        
-        previous_diary_summary = await self.summarize_and_forget_diaries(diaries)
-        
-        prompt = self.default_prompt.format(
-            style=self.diary_style,
-            min_word_count=self.min_word_count,
-            max_word_count=self.max_word_count,
-            date=date_info,
-            history=previous_diary_summary if previous_diary_summary else '暂无历史记录'
-        )
-        
         try:
-            llm_response = await self.context.get_using_provider().text_chat(
-                prompt=prompt,
-                contexts=[],
-                func_tool=None
-            )
-            if llm_response.role == "assistant":
-                diary_content = llm_response.completion_text.strip()
-                time_str = f"{current_time} {weather}周{weekday_cn}"
-                emotion_score = await self._analyze_emotion_intensity(diary_content)
-                is_important = emotion_score >= self.emotion_threshold
-                if emotion_score > 0:
-                    logger.info(f"日记情感强度评分: {emotion_score}, 标记为重要: {is_important}")
-                else:
-                    logger.warning("情感强度分析失败，默认不标记为重要")
-                    is_important = False
-                diaries[today] = {'time': time_str, 'content': diary_content, 'important': is_important, 'emotion_score': emotion_score}
-                self._save_diaries(diaries)
-                self._backup_original_diary(today, time_str, diary_content)
-                result_msg = f"【今日舔狗日记 - {diaries[today]['time']}】\n{diary_content}"
-                if emotion_score > 0:
-                    result_msg += f"\n(情感强度: {emotion_score}/10)"
-                yield event.plain_result(result_msg)
-                return
-            else:
-                yield event.plain_result("生成日记失败，请稍后重试。")
-                return
+            entry = await self._get_today_diary(timeline)
         except Exception as e:
             logger.error(f"调用 LLM 生成日记时出错: {e}")
             yield event.plain_result("生成日记时发生错误，请稍后重试。")
+            return
+        if entry is None:
+            yield event.plain_result("生成日记失败，请稍后重试。")
+            return
+        result_msg = f"【今日舔狗日记 - {entry['time']}】\n{entry['content']}"
+        if entry.get('emotion_score', 0) > 0:
+            result_msg += f"\n(情感强度: {entry['emotion_score']}/10)"
+        yield event.plain_result(result_msg)
 
     @filter.command("舔狗日记")
     async def temporary_diary(self, event: AstrMessageEvent):
+        await self._ensure_ready()
         current_umo = event.unified_msg_origin
         if not self.base_umo or self.base_umo != current_umo:
-            self._save_base_umo(current_umo)
+            await self._save_base_umo(current_umo)
             logger.info("检测到 unified_msg_origin 变更或首次记录，已更新基础模板缓存。")
         else:
             logger.info("unified_msg_origin 未变更，无需更新基础模板缓存。")
         
-        current_time = datetime.now().strftime("%Y-%m-%d")
-        weekday = datetime.now().strftime("%w")
-        weather = random.choice(['☀️', '🌥', '🌧', '🌪'])
-        weekdays = ['日', '一', '二', '三', '四', '五', '六']
-        weekday_cn = weekdays[int(weekday)]
-        date_info = f"{current_time} {weather}周{weekday_cn}"
-        
-        diaries = self._load_diaries()
-        if not diaries and diaries != {}:
-            yield event.plain_result("读取日记文件失败，请稍后重试。")
+        timeline = await self._get_timeline(current_umo)
+        if self.streaming:
+            async for result in self._stream_diary(event, timeline, "临时舔狗日记", "生成临时日记", save=False):
+                yield result
             return
-        
-        previous_diary_summary = await self.summarize_and_forget_diaries(diaries)
-        
-        prompt = self.default_prompt.format(
-            style=self.diary_style,
-            min_word_count=self.min_word_count,
-            max_word_count=self.max_word_count,
-            date=date_info,
-            history=previous_diary_summary if previous_diary_summary else '暂无历史记录'
-        )
+        time_str = self._build_date_info()
+        previous_diary_summary = await self.summarize_and_forget_diaries(timeline)
+        prompt = self._build_prompt(timeline, time_str, previous_diary_summary)
         
         try:
-            llm_response = await self.context.get_using_provider().text_chat(
-                prompt=prompt,
-                contexts=[],
-                func_tool=None
-            )
-            if llm_response.role == "assistant":
-                diary_content = llm_response.completion_text.strip()
-                time_str = f"{current_time} {weather}周{weekday_cn}"
-                emotion_score = await self._analyze_emotion_intensity(diary_content)
+            generated = await self._generate_diary_text(prompt)
+            if generated:
+                diary_content, emotion_score = generated
                 if emotion_score > 0:
                     logger.info(f"临时日记情感强度评分: {emotion_score}")
                 result_msg = f"【临时舔狗日记 - {time_str}】\n{diary_content}"
@@ -450,39 +2167,261 @@ class LickDogDiaryPlugin(Star):
 
     @filter.command("舔狗日记列表")
     async def list_diaries(self, event: AstrMessageEvent):
-        diaries = self._load_diaries()
-        if not diaries:
+        timeline = await self._get_timeline(event.unified_msg_origin)
+        if not len(timeline.store):
             yield event.plain_result("暂无日记记录。")
             return
         
-        message_str = event.message_str.strip()
-        date_pattern = r'(\d{1,2})\.(\d{1,2})'
-        match = re.search(date_pattern, message_str)
+        try:
+            query = self._parse_list_query(event.message_str)
+        except ValueError:
+            yield event.plain_result("日期格式无效，示例：'舔狗日记列表 4.17'、'舔狗日记列表 2025-04-17'、'舔狗日记列表 2025.4'、'舔狗日记列表 4.1-4.17 2'。")
+            return
         
-        if match:
-            month = int(match.group(1))
-            day = int(match.group(2))
-            current_year = datetime.now().year
-            target_date = f"{current_year:04d}-{month:02d}-{day:02d}"
-            
-            if target_date in diaries:
-                diary = diaries[target_date]
+        if query["date"]:
+            target_date = query["date"]
+            diary = self._load_diary(timeline, target_date)
+            if diary is not None:
                 result_msg = f"【舔狗日记 - {diary['time']}】\n{diary['content']}"
                 if 'emotion_score' in diary and diary['emotion_score'] > 0:
                     result_msg += f"\n(情感强度: {diary['emotion_score']}/10)"
-                yield event.plain_result(result_msg)
+                yield self._make_result(event, result_msg)
             else:
                 yield event.plain_result(f"未找到日期为 {target_date} 的日记记录。")
             return
         
+        start, end, page = query["start"], query["end"], query["page"]
+        total = timeline.store.count(start, end)
+        if not total:
+            yield event.plain_result(f"{start} 至 {end} 之间没有日记记录。")
+            return
+        page_count = (total + self.list_page_size - 1) // self.list_page_size
+        if page > page_count:
+            yield event.plain_result(f"页码超出范围，共 {page_count} 页。")
+            return
+        
         diary_list = []
-        sorted_diaries = sorted(diaries.items(), key=lambda x: date.fromisoformat(x[0]), reverse=True)
-        for diary_date, diary in sorted_diaries:
+        for diary_date, diary in timeline.store.range(start, end, reverse=True,
+                                                      offset=(page - 1) * self.list_page_size,
+                                                      limit=self.list_page_size):
             important_mark = "⭐" if diary.get('important', False) else ""
             emotion_score = diary.get('emotion_score', 'N/A')
             diary_list.append(f"{diary_date} - {diary['time'].split(' ')[1]} {important_mark} (情感强度: {emotion_score}/10)")
         
-        yield event.plain_result(f"【舔狗日记列表】\n" + "\n".join(diary_list))
+        header = "【舔狗日记列表】"
+        if query["args"]:
+            header += f" {start} 至 {end}"
+        header += f"\n第 {page}/{page_count} 页，共 {total} 篇"
+        if page < page_count:
+            header += f"，发送 '舔狗日记列表 {query['args']}{' ' if query['args'] else ''}{page + 1}' 查看下一页"
+        yield self._make_result(event, header + "\n" + "\n".join(diary_list))
+
+    @staticmethod
+    def _parse_list_query(message_str: str) -> Dict[str, Any]:
+        # 支持：页码（2）、单日（4.17 / 2025.4.17 / 2025-04-17）、整月（2025.4 / 2025-04）、整年（2025）、
+        # 区间（4.1-4.17 / 2025.3-2025.4 / 2025-04-01~2025-04-17）
+        args = message_str.strip()
+        if args.startswith("舔狗日记列表"):
+            args = args[len("舔狗日记列表"):].strip()
+        query = {"date": "", "start": "", "end": "9999-12-31", "page": 1, "args": ""}
+        tokens = args.split()
+        if tokens and re.fullmatch(r"第?\d{1,3}页?", tokens[-1]):
+            query["page"] = max(1, int(re.sub(r"\D", "", tokens.pop())))
+        if not tokens:
+            return query
+        spec = "".join(tokens)
+        query["args"] = spec
+        parse = LickDogDiaryPlugin._parse_date_spec
+        parts = re.split(r"[~～至到]", spec)
+        if len(parts) == 1 and "-" in spec:
+            parts = LickDogDiaryPlugin._split_dash_range(spec)
+        if len(parts) == 1:
+            start, exact = parse(parts[0], False)
+            if exact:
+                query["date"] = start
+                return query
+            query["start"], query["end"] = start, parse(parts[0], True)[0]
+        elif len(parts) == 2:
+            query["start"], query["end"] = parse(parts[0], False)[0], parse(parts[1], True)[0]
+        else:
+            raise ValueError(spec)
+        if query["start"] > query["end"]:
+            raise ValueError(spec)
+        return query
+
+    @staticmethod
+    def _split_dash_range(spec: str) -> List[str]:
+        # "-" 既可能是日期内的分隔符（2025-04-17）也可能是区间分隔符（4.1-4.17）：整体能解析为一个日期时不拆分，
+        # 否则取第一个使两侧都能解析的 "-" 拆成区间
+        parse = LickDogDiaryPlugin._parse_date_spec
+        try:
+            parse(spec, False)
+            return [spec]
+        except ValueError:
+            pass
+        for match in re.finditer("-", spec):
+            left, right = spec[:match.start()], spec[match.end():]
+            try:
+                parse(left, False)
+                parse(right, True)
+            except ValueError:
+                continue
+            return [left, right]
+        raise ValueError(spec)
+
+    @staticmethod
+    def _parse_date_spec(part: str, is_end: bool) -> Tuple[str, bool]:
+        # 解析 4.17 / 2025.4.17 / 2025.4 / 2025，返回 (日期, 是否精确到日)；月份和年份按 is_end 取首日或末日
+        numbers = [int(n) for n in re.split(r"[./年月日-]+", part.strip("日")) if n]
+        if len(numbers) == 3:
+            return date(numbers[0], numbers[1], numbers[2]).isoformat(), True
+        if len(numbers) == 2 and numbers[0] >= 1000:
+            year, month = numbers
+            first = date(year, month, 1)
+            if not is_end:
+                return first.isoformat(), False
+            last = (first.replace(day=28) + timedelta(days=4)).replace(day=1) - timedelta(days=1)
+            return last.isoformat(), False
+        if len(numbers) == 2:
+            return date(datetime.now().year, numbers[0], numbers[1]).isoformat(), True
+        if len(numbers) == 1 and numbers[0] >= 1000:
+            return date(numbers[0], 12 if is_end else 1, 31 if is_end else 1).isoformat(), False
+        raise ValueError(part)
+
+    @filter.command("舔狗日记搜索")
+    async def search_diaries(self, event: AstrMessageEvent):
+        args = event.message_str.strip()
+        if args.startswith("舔狗日记搜索"):
+            args = args[len("舔狗日记搜索"):].strip()
+        keywords, important_only, min_score = [], False, 0
+        for token in args.split():
+            score_match = re.fullmatch(r"情感(?:强度)?(>=|>|:|：|=)?(\d{1,2})", token)
+            if token in ("重要", "⭐"):
+                important_only = True
+            elif score_match:
+                min_score = int(score_match.group(2)) + (1 if score_match.group(1) == ">" else 0)
+            else:
+                keywords.append(token)
+        keyword = " ".join(keywords)
+        if not keyword:
+            yield event.plain_result("请提供搜索关键词，例如：'舔狗日记搜索 下雨'，可附加 '重要' 或 '情感>=7' 进行筛选。")
+            return
+        
+        timeline = await self._get_timeline(event.unified_msg_origin)
+        matches = []
+        hits = await asyncio.to_thread(timeline.search_index.search, keyword)
+        diaries = timeline.store.get_many([diary_date for diary_date, _ in hits])
+        for diary_date, score in hits:
+            diary = diaries.get(diary_date)
+            if diary is None:
+                continue
+            if important_only and not diary.get('important', False):
+                continue
+            if diary.get('emotion_score', 0) < min_score:
+                continue
+            # 包含完整关键词（去掉空格）的结果排在前面
+            exact = "".join(keywords) in diary['content']
+            matches.append((not exact, -score, diary_date, diary))
+        if not matches:
+            yield event.plain_result(f"没有找到包含 '{keyword}' 的日记。")
+            return
+        
+        matches.sort(key=lambda x: x[:3])
+        lines = [f"【舔狗日记搜索】'{keyword}' 共找到 {len(matches)} 篇，显示前 {min(len(matches), SEARCH_RESULT_LIMIT)} 篇"]
+        for _, _, diary_date, diary in matches[:SEARCH_RESULT_LIMIT]:
+            important_mark = "⭐" if diary.get('important', False) else ""
+            lines.append(f"{diary_date} {important_mark}(情感强度: {diary.get('emotion_score', 'N/A')}/10)\n"
+                         f"  {self._search_snippet(diary['content'], keywords)}")
+        yield self._make_result(event, "\n".join(lines))
+
+    @staticmethod
+    def _search_snippet(content: str, keywords: List[str], width: int = 20) -> str:
+        positions = [content.find(k) for k in keywords if k in content]
+        pos = min(positions) if positions else 0
+        start = max(0, pos - width)
+        snippet = content[start:pos + width * 2].replace("\n", " ")
+        return ("…" if start > 0 else "") + snippet + ("…" if pos + width * 2 < len(content) else "")
+
+    @filter.command("舔狗日记统计")
+    async def show_statistics(self, event: AstrMessageEvent):
+        timeline = await self._get_timeline(event.unified_msg_origin)
+        rollup = timeline.rollup
+        await asyncio.to_thread(rollup.sync, timeline.store)
+        if not rollup.total:
+            yield event.plain_result("暂无日记记录。")
+            return
+        
+        with rollup.lock:
+            scored = sum(rollup.distribution[1:])
+            score_sum = sum(score * count for score, count in enumerate(rollup.distribution))
+            today = date.today().toordinal()
+            longest_start, longest_end = rollup.days.longest()
+            important_start, important_end = rollup.important_days.longest()
+            lines = [
+                "【舔狗日记统计】",
+                f"日记总数: {rollup.total} 篇，重要日记: {rollup.important} 篇",
+                f"平均情感强度: {score_sum / scored:.1f}/10" if scored else "平均情感强度: 暂无评分",
+                f"连续写日记: 当前 {rollup.days.ending_at(today)} 天，最长 {longest_end - longest_start + 1} 天"
+                f"（{date.fromordinal(longest_start)} 至 {date.fromordinal(longest_end)}）",
+                f"连续重要日记: 最长 {max(0, important_end - important_start + 1)} 天",
+                "",
+                "情感强度分布:",
+            ]
+            peak = max(rollup.distribution[1:]) or 1
+            for score in range(10, 0, -1):
+                count = rollup.distribution[score]
+                lines.append(f"{score:>2} 分 {'█' * round(count * 10 / peak)} {count}")
+            lines += ["", f"最近 {STATS_RECENT_WEEKS} 周平均:"]
+            lines += [self._format_rollup_bucket(f"{key} 起的一周", rollup.weeks[key])
+                      for key in sorted(rollup.weeks, reverse=True)[:STATS_RECENT_WEEKS]]
+            lines += ["", f"最近 {STATS_RECENT_MONTHS} 个月平均:"]
+            lines += [self._format_rollup_bucket(key, rollup.months[key])
+                      for key in sorted(rollup.months, reverse=True)[:STATS_RECENT_MONTHS]]
+            top = rollup.top(STATS_TOP_ENTRIES)
+        
+        if top:
+            lines += ["", "情感最强烈的日记:"]
+            diaries = timeline.store.get_many([diary_date for diary_date, _ in top])
+            for diary_date, score in top:
+                content = diaries.get(diary_date, {}).get('content', '').replace("\n", " ")
+                lines.append(f"{diary_date} ({score}/10) {content[:30]}{'…' if len(content) > 30 else ''}")
+        yield self._make_result(event, "\n".join(lines))
+
+    @staticmethod
+    def _format_rollup_bucket(label: str, bucket: List[int]) -> str:
+        count, scored, score_sum, important = bucket
+        average = f"{score_sum / scored:.1f}" if scored else "-"
+        return f"{label}: {average}/10，{count} 篇，重要 {important} 篇"
+
+    @filter.permission_type(filter.PermissionType.ADMIN)
+    @filter.command("舔狗日记情感校准")
+    async def calibrate_emotion(self, event: AstrMessageEvent):
+        timeline = await self._get_timeline(event.unified_msg_origin)
+        diaries = timeline.store.load_all()
+        report = calibrate_emotion_scorer(self.local_scorer, diaries, self.emotion_threshold)
+        if not report["samples"]:
+            yield event.plain_result("暂无带情感强度评分的日记，无法校准。")
+            return
+        yield event.plain_result(
+            "【本地情感评分校准】\n"
+            f"样本数: {report['samples']}\n"
+            f"平均绝对误差: {report['mae']:.2f}\n"
+            f"平均偏差(本地-已存): {report['bias']:+.2f}\n"
+            f"相关系数: {report['correlation']:.2f}\n"
+            f"重要标记一致率: {report['important_agreement']:.0%}\n"
+            f"当前评分方式: {'本地词典' if self.emotion_scorer == 'local' else 'LLM'}"
+        )
+
+    @filter.permission_type(filter.PermissionType.ADMIN)
+    @filter.command("舔狗日记状态")
+    async def show_metrics(self, event: AstrMessageEvent):
+        timeline = await self._get_timeline(event.unified_msg_origin)
+        yield self._make_result(event, (
+            "【舔狗日记运行状态】\n"
+            f"日记总数: {len(timeline.store)}\n"
+            f"已打开的分群时间线: {len(self._timelines)}\n"
+            + self.metrics.report()
+        ))
 
     @filter.command("舔狗帮助")
     async def help_command(self, event: AstrMessageEvent):
@@ -492,8 +2431,14 @@ class LickDogDiaryPlugin(Star):
             "可用指令列表：\n"
             "- 今日舔狗日记：查看或生成当天的舔狗日记。\n"
             "- 舔狗日记：基于历史记忆临时生成一份舔狗日记，不保存，同时初始化定时发送环境。\n"
-            "- 舔狗日记列表：列出所有日记的日期和天气信息，可附加日期（如 '舔狗日记列表 4.17'）查看特定日期日记。\n"
+            "- 舔狗日记列表：分页列出日记的日期和天气信息，可附加页码（如 '舔狗日记列表 2'）、"
+            "日期（如 '4.17'、'2025.4.17'、'2025-04-17'）、月份（如 '2025.4'）或区间（如 '4.1-4.17'、'2025-04-01~2025-04-17'）。\n"
             "- 重写舔狗日记：重写当天的舔狗日记，覆盖原有内容。\n"
+            "- 舔狗日记搜索：按关键词搜索历史日记，可附加 '重要' 或 '情感>=7' 筛选（如 '舔狗日记搜索 下雨 重要'）。\n"
+            "- 舔狗日记统计：查看按周、按月的平均情感强度、连续天数、评分分布和情感最强烈的日记。\n"
+            "- 舔狗日记情感校准：对比本地情感评分与已保存的评分（仅管理员）。\n"
+            "- 舔狗日记补写 <起始日期> <结束日期>：补写这段时间内缺失的日记，每篇都会参考之前的日记（仅管理员）。\n"
+            "- 舔狗日记状态：查看各阶段耗时、LLM 调用、缓存命中率和发送失败统计（仅管理员）。\n"
             "- 舔狗帮助：显示本帮助信息。\n\n"
             f"日记将每天在 {self.auto_generate_time} 自动生成，"
             f"在 {self.auto_send_time} 自动发送到指定群组。\n"
@@ -504,105 +2449,334 @@ class LickDogDiaryPlugin(Star):
     @filter.command("重写舔狗日记")
     async def rewrite_diary(self, event: AstrMessageEvent):
         today = date.today().isoformat()
-        diaries = self._load_diaries()
         
+        if self.streaming:
+            timeline = await self._get_timeline(event.unified_msg_origin)
+            async for result in self._stream_diary(event, timeline, "重写舔狗日记", "重写日记"):
+                yield result
+            return
         yield event.plain_result("正在重写今天的舔狗日记...")
-        current_time = datetime.now().strftime("%Y-%m-%d")
-        weekday = datetime.now().strftime("%w")
-        weather = random.choice(['☀️', '🌥', '🌧', '🌪'])
-        weekdays = ['日', '一', '二', '三', '四', '五', '六']
-        weekday_cn = weekdays[int(weekday)]
-        date_info = f"{current_time} {weather}周{weekday_cn}"
-        
-        previous_diary_summary = await self.summarize_and_forget_diaries(diaries)
-        prompt = self.default_prompt.format(
-            style=self.diary_style,
-            min_word_count=self.min_word_count,
-            max_word_count=self.max_word_count,
-            date=date_info,
-            history=previous_diary_summary if previous_diary_summary else '暂无历史记录'
-        )
-        
         try:
-            llm_response = await self.context.get_using_provider().text_chat(
-                prompt=prompt,
-                contexts=[],
-                func_tool=None
-            )
-            if llm_response.role == "assistant":
-                diary_content = llm_response.completion_text.strip()
-                time_str = f"{current_time} {weather}周{weekday_cn}"
-                emotion_score = await self._analyze_emotion_intensity(diary_content)
-                is_important = emotion_score >= self.emotion_threshold
-                if emotion_score > 0:
-                    logger.info(f"重写日记情感强度评分: {emotion_score}, 标记为重要: {is_important}")
-                else:
-                    logger.warning("情感强度分析失败，默认不标记为重要")
-                    is_important = False
-                diaries[today] = {'time': time_str, 'content': diary_content, 'important': is_important, 'emotion_score': emotion_score}
-                self._save_diaries(diaries)
-                self._backup_original_diary(today, time_str, diary_content)
-                result_msg = f"【重写舔狗日记 - {diaries[today]['time']}】\n{diary_content}"
-                if emotion_score > 0:
-                    result_msg += f"\n(情感强度: {emotion_score}/10)"
-                yield event.plain_result(result_msg)
-                return
-            else:
+            timeline = await self._get_timeline(event.unified_msg_origin)
+            entry = await self._generate_entry(timeline, "重写日记")
+            if entry is None:
                 yield event.plain_result("重写日记失败，请稍后重试。")
                 return
+            if not await self._save_diary(timeline, today, entry):
+                yield event.plain_result("保存日记失败，请稍后重试。")
+                return
+            await self._backup_original_diary(timeline, today, entry['time'], entry['content'])
+            result_msg = f"【重写舔狗日记 - {entry['time']}】\n{entry['content']}"
+            if entry['emotion_score'] > 0:
+                result_msg += f"\n(情感强度: {entry['emotion_score']}/10)"
+            yield event.plain_result(result_msg)
         except Exception as e:
             logger.error(f"调用 LLM 重写日记时出错: {e}")
             yield event.plain_result("重写日记时发生错误，请稍后重试。")
 
-    async def summarize_and_forget_diaries(self, diaries: Dict[str, Any]) -> str:
-        if not diaries:
+    @filter.permission_type(filter.PermissionType.ADMIN)
+    @filter.command("舔狗日记补写")
+    async def backfill_diaries(self, event: AstrMessageEvent):
+        args = event.message_str.strip()
+        if args.startswith("舔狗日记补写"):
+            args = args[len("舔狗日记补写"):].strip()
+        parts = args.split()
+        try:
+            if len(parts) != 2:
+                raise ValueError(args)
+            start = self._parse_date_spec(parts[0], False)[0]
+            end = min(self._parse_date_spec(parts[1], True)[0], date.today().isoformat())
+            if start > end:
+                raise ValueError(args)
+        except ValueError:
+            yield event.plain_result("用法：舔狗日记补写 <起始日期> <结束日期>，例如 '舔狗日记补写 2025.4.1 2025.4.7'，结束日期不能晚于今天。")
+            return
+        
+        timeline = await self._get_timeline(event.unified_msg_origin)
+        first, last = date.fromisoformat(start), date.fromisoformat(end)
+        missing = [d for d in ((first + timedelta(days=i)).isoformat() for i in range((last - first).days + 1))
+                   if d not in timeline.store]
+        if not missing:
+            yield event.plain_result(f"{start} 至 {end} 之间没有缺失的日记。")
+            return
+        if len(missing) > BACKFILL_MAX_DAYS:
+            yield event.plain_result(f"{start} 至 {end} 之间缺失 {len(missing)} 篇日记，一次最多补写 {BACKFILL_MAX_DAYS} 篇，请缩小日期范围。")
+            return
+        
+        yield event.plain_result(f"正在补写 {start} 至 {end} 之间缺失的 {len(missing)} 篇日记...")
+        try:
+            saved, failed = await self._single_flight(f"backfill_{timeline.key}_{start}_{end}",
+                                                      lambda: self._backfill(timeline, missing))
+        except Exception as e:
+            logger.error(f"补写日记时出错: {e}")
+            yield event.plain_result("补写日记时发生错误，请稍后重试。")
+            return
+        result_msg = f"【舔狗日记补写】成功补写 {len(saved)} 篇"
+        if saved:
+            result_msg += "：\n" + "\n".join(saved)
+        if failed:
+            result_msg += f"\n以下 {len(failed)} 篇生成失败，可稍后重新补写：\n" + "\n".join(failed)
+        yield self._make_result(event, result_msg)
+
+    async def _backfill(self, timeline: DiaryTimeline, missing: List[str]) -> Tuple[List[str], List[str]]:
+        # 按日期顺序逐篇生成，每篇的历史记录包含之前已补写的日记；已有日记的摘要提前并发生成，
+        # 每篇的情感评分和之后需要的摘要在后台与下一篇的生成并行，最后一次性写入存储
+        last = date.fromisoformat(missing[-1])
+        window_start = (date.fromisoformat(missing[0]) - timedelta(days=HISTORY_WINDOW_DAYS)).isoformat()
+        summary_before = (last - timedelta(days=RECENT_FULL_TEXT_DAYS)).isoformat()
+        diaries = dict(timeline.store.range(window_start, missing[-1]))
+        semaphore = asyncio.Semaphore(self.summary_concurrency)
+        summaries: Dict[str, asyncio.Future] = {}
+        emotions: Dict[str, asyncio.Future] = {}
+        generated: Dict[str, Dict[str, Any]] = {}
+        failed: List[str] = []
+
+        async def summarize(diary_date: str) -> str:
+            emotion = emotions.get(diary_date)
+            if emotion is not None:
+                self._apply_emotion_score(diaries[diary_date], await emotion)
+            if diaries[diary_date].get('important', False):
+                return ""
+            return (timeline.get_cached_summary(diary_date)
+                    or await self._summarize_diary(timeline, diary_date, diaries[diary_date], semaphore))
+
+        def request_summary(diary_date: str) -> asyncio.Future:
+            if diary_date not in summaries:
+                summaries[diary_date] = asyncio.ensure_future(summarize(diary_date))
+            return summaries[diary_date]
+
+        for diary_date, diary in diaries.items():
+            if diary_date < summary_before and not diary.get('important', False):
+                request_summary(diary_date)
+
+        try:
+            for target in missing:
+                target_day = date.fromisoformat(target)
+                items: Dict[str, List[str]] = {}
+                for diary_date in sorted(diaries):
+                    if not (target_day - timedelta(days=HISTORY_WINDOW_DAYS)).isoformat() <= diary_date < target:
+                        continue
+                    diary = diaries[diary_date]
+                    days_diff = (target_day - date.fromisoformat(diary_date)).days
+                    emotion = emotions.get(diary_date)
+                    if emotion is not None and (emotion.done() or days_diff > RECENT_FULL_TEXT_DAYS):
+                        self._apply_emotion_score(diary, await emotion)
+                    if diary.get('important', False):
+                        items[diary_date] = ["important", f"[重要日记 {diary_date}] {diary['content']}"]
+                    elif days_diff <= RECENT_FULL_TEXT_DAYS:
+                        items[diary_date] = ["recent", f"[最近日记 {diary_date}] {diary['content']}"]
+                    else:
+                        summary = await request_summary(diary_date)
+                        items[diary_date] = ["summary", summary or f"[摘要 {diary_date}] 无法获取摘要"]
+
+                time_str = self._build_date_info(target_day)
+                prompt = self._build_prompt(timeline, time_str, self._assemble_history(items))
+                try:
+                    result = await self._generate_diary_text(prompt, score_emotion=False)
+                except Exception as e:
+                    logger.error(f"补写日记时出错 (日期: {target}): {e}")
+                    result = None
+                if not result:
+                    failed.append(target)
+                    continue
+                content, score = result
+                entry = {'time': time_str, 'content': content, 'important': False, 'emotion_score': 0}
+                if score is None:
+                    emotions[target] = asyncio.ensure_future(self._analyze_emotion_intensity(content))
+                else:
+                    self._apply_emotion_score(entry, score)
+                diaries[target] = generated[target] = entry
+                if target < summary_before:
+                    request_summary(target)
+                logger.info(f"已补写日记: {target}")
+
+            for diary_date, emotion in emotions.items():
+                self._apply_emotion_score(diaries[diary_date], await emotion)
+        finally:
+            for task in list(summaries.values()) + list(emotions.values()):
+                task.cancel()
+
+        # 补写期间已有其他途径写入的日期不覆盖
+        generated = {d: entry for d, entry in generated.items() if d not in timeline.store}
+        if generated:
+            await asyncio.to_thread(timeline.save_entries, generated)
+            try:
+                await asyncio.to_thread(timeline.search_index.add_many, {d: e['content'] for d, e in generated.items()})
+            except Exception as e:
+                logger.error(f"更新全文索引时出错: {e}")
+            for diary_date, entry in generated.items():
+                await self._backup_original_diary(timeline, diary_date, entry['time'], entry['content'])
+                timeline.mark_history_dirty(diary_date)
+            timeline.schedule_compaction()
+        timeline.compact_summary_cache()
+        await self._save_summary_cache(timeline)
+        logger.info(f"补写日记完成：成功 {len(generated)} 篇，失败 {len(failed)} 篇")
+        return sorted(generated), failed
+
+    def _apply_emotion_score(self, entry: Dict[str, Any], emotion_score: int):
+        entry['emotion_score'] = emotion_score
+        entry['important'] = emotion_score >= self.emotion_threshold
+
+    async def summarize_and_forget_diaries(self, timeline: DiaryTimeline) -> str:
+        if not len(timeline.store):
             return ""
             
-        today = date.today().isoformat()
-        summaries = []
-        sorted_diaries = sorted(diaries.items(), key=lambda x: date.fromisoformat(x[0]), reverse=True)
-        
-        cache_key = f"summary_{today}"
-        if cache_key in self.summary_cache:
+        today = date.today()
+        state = timeline.summary_cache.get(HISTORY_STATE_KEY)
+        prepared = timeline.summary_cache.get(HISTORY_NEXT_KEY)
+        if prepared and prepared.get("date") == today.isoformat() and (not state or state.get("date") != today.isoformat()):
+            # 使用预热任务提前算好的历史记录，被标记为脏的日期仍会在下面增量更新
+            logger.info("使用预热的历史日记总结")
+            state = timeline.summary_cache[HISTORY_STATE_KEY] = timeline.summary_cache.pop(HISTORY_NEXT_KEY)
+        if state and state.get("date") == today.isoformat() and not state.get("dirty"):
             logger.info("使用缓存的历史日记总结")
-            return self.summary_cache[cache_key]
-        
-        thirty_days_ago = date.today() - timedelta(days=30)
-        filtered_diaries = [(d_date, d) for d_date, d in sorted_diaries if date.fromisoformat(d_date) >= thirty_days_ago and d_date != today]
+            self.metrics.cache("history", True)
+            return state["text"]
+        self.metrics.cache("history", False)
+        return await self._single_flight(f"history_{timeline.key}_{today.isoformat()}",
+                                         lambda: self._roll_history(timeline, today))
+
+    async def _warm_up_history(self) -> bool:
+        # 在空闲时段提前算好下一次生成日记要用的历史记录和缺失的单篇摘要，生成时只需一次 LLM 调用
+        now = datetime.now()
+        target = now.date()
+        try:
+            if (now.hour, now.minute) >= tuple(map(int, self.auto_generate_time.split(':'))):
+                target += timedelta(days=1)
+        except ValueError:
+            pass
+        timelines = [self.global_timeline]
+        if self.group_timelines:
+            if self.base_umo:
+                await self._get_group_timelines(self.auto_send_groups)
+            timelines = list(self._timelines.values())
+        ok = True
+        for timeline in timelines:
+            if not len(timeline.store):
+                continue
+            key = HISTORY_STATE_KEY if target == now.date() else HISTORY_NEXT_KEY
+            state = timeline.summary_cache.get(key)
+            if state and state.get("date") == target.isoformat() and not state.get("dirty"):
+                continue
+            try:
+                await self._single_flight(f"history_{timeline.key}_{target.isoformat()}",
+                                          lambda t=timeline: self._roll_history(t, target))
+            except Exception as e:
+                logger.error(f"预热历史日记总结时出错 ({timeline.key}): {e}")
+                ok = False
+                continue
+            state = timeline.summary_cache.get(key) or {}
+            ok = ok and not state.get("dirty")
+            logger.info(f"已预热 {target.isoformat()} 的历史日记总结 ({timeline.key})")
+        return ok
+
+    async def _roll_history(self, timeline: DiaryTimeline, target: date) -> str:
+        # 为 target 当天生成日记滚动更新历史记录；target 晚于今天时（预热）结果另存，不影响今天的历史记录
+        today = target
+        key = HISTORY_STATE_KEY if target <= date.today() else HISTORY_NEXT_KEY
+        state = timeline.summary_cache.get(key)
+        if key == HISTORY_NEXT_KEY and not (state and state.get("date") == target.isoformat()):
+            state = timeline.summary_cache.get(HISTORY_STATE_KEY)
+        window_start = today - timedelta(days=HISTORY_WINDOW_DAYS)
+        items: Dict[str, List[str]] = {}
+        if state and "items" in state and window_start <= date.fromisoformat(state["date"]) <= today:
+            # 在前一次的滚动结果上增量更新：只重新处理新增日期、刚跨过 7 天边界的日期和被标记为脏的日期
+            previous = date.fromisoformat(state["date"])
+            items = {d: item for d, item in state["items"].items() if d >= window_start.isoformat()}
+            touched = {(previous + timedelta(days=i)).isoformat() for i in range((today - previous).days)}
+            touched |= {(previous - timedelta(days=RECENT_FULL_TEXT_DAYS - i)).isoformat()
+                        for i in range((today - previous).days)}
+            touched |= set(state.get("dirty", []))
+            touched = {d for d in touched if window_start.isoformat() <= d < today.isoformat()}
+        else:
+            touched = {(window_start + timedelta(days=i)).isoformat() for i in range(HISTORY_WINDOW_DAYS)}
         
-        for diary_date, diary in filtered_diaries:
+        diaries = timeline.store.get_many(sorted(touched))
+        pending = {}
+        for diary_date in touched:
+            diary = diaries.get(diary_date)
+            if diary is None:
+                items.pop(diary_date, None)
+                continue
             if diary.get('important', False):
-                summaries.append(f"[重要日记 {diary_date}] {diary['content']}")
+                items[diary_date] = ["important", f"[重要日记 {diary_date}] {diary['content']}"]
                 continue
             
-            days_diff = (date.today() - date.fromisoformat(diary_date)).days
-            if days_diff <= 7:
-                summaries.append(f"[最近日记 {diary_date}] {diary['content']}")
-            elif days_diff <= 30:
-                cache_key_specific = f"summary_{diary_date}"
-                if cache_key_specific in self.summary_cache:
-                    summaries.append(self.summary_cache[cache_key_specific])
+            days_diff = (today - date.fromisoformat(diary_date)).days
+            if days_diff <= RECENT_FULL_TEXT_DAYS:
+                items[diary_date] = ["recent", f"[最近日记 {diary_date}] {diary['content']}"]
+            else:
+                cached = timeline.get_cached_summary(diary_date)
+                self.metrics.cache("summary", bool(cached))
+                if cached:
+                    items[diary_date] = ["summary", cached]
                 else:
-                    summary_prompt = f"请提取以下日记中的关键情感信息，不超过50字：\n{diary['content']}"
-                    try:
-                        llm_response = await self.context.get_using_provider().text_chat(
-                            prompt=summary_prompt,
-                            contexts=[],
-                            func_tool=None
-                        )
-                        if llm_response.role == "assistant":
-                            summary_text = llm_response.completion_text
-                            summaries.append(f"[摘要 {diary_date}] {summary_text}")
-                            self.summary_cache[cache_key_specific] = f"[摘要 {diary_date}] {summary_text}"
-                            logger.info(f"生成并缓存日记摘要: {diary_date}")
-                    except Exception as e:
-                        logger.error(f"总结日记时出错 (日期: {diary_date}): {e}")
-                        summaries.append(f"[摘要 {diary_date}] 无法获取摘要")
+                    pending[diary_date] = diary
+                    items[diary_date] = ["summary", f"[摘要 {diary_date}] 无法获取摘要"]
         
-        result_summary = "\n".join(summaries) if summaries else "暂无历史记录"
-        self.summary_cache[cache_key] = result_summary
-        self._save_summary_cache(self.summary_cache)
+        failed = []
+        if pending:
+            semaphore = asyncio.Semaphore(self.summary_concurrency)
+            dates = list(pending)
+            results = await asyncio.gather(*(self._summarize_diary(timeline, d, pending[d], semaphore) for d in dates))
+            for diary_date, summary in zip(dates, results):
+                if summary:
+                    items[diary_date][1] = summary
+                else:
+                    failed.append(diary_date)
+        
+        result_summary = self._assemble_history(items)
+        timeline.summary_cache[key] = {
+            "date": today.isoformat(),
+            "items": items,
+            "dirty": failed,
+            "text": result_summary,
+        }
+        timeline.compact_summary_cache()
+        await self._save_summary_cache(timeline)
         return result_summary
 
+    def _assemble_history(self, items: Dict[str, List[str]]) -> str:
+        # 按 最近全文 > 重要日记 > 摘要 的优先级在字数预算内挑选，输出时仍按日期倒序
+        priority = {"recent": 0, "important": 1, "summary": 2}
+        ordered = sorted(sorted(items.items(), reverse=True), key=lambda x: priority[x[1][0]])
+        budget = self.history_max_chars
+        selected = []
+        for diary_date, (_, line) in ordered:
+            if len(line) + 1 > budget:
+                continue
+            selected.append(diary_date)
+            budget -= len(line) + 1
+        if len(selected) < len(items):
+            logger.info(f"历史记录超出 {self.history_max_chars} 字预算，已省略 {len(items) - len(selected)} 篇较早的日记")
+        return "\n".join(items[d][1] for d in sorted(selected, reverse=True)) or "暂无历史记录"
+
+    async def _summarize_diary(self, timeline: DiaryTimeline, diary_date: str, diary: Dict[str, Any],
+                               semaphore: asyncio.Semaphore) -> str:
+        summary_prompt = f"请提取以下日记中的关键情感信息，不超过50字：\n{diary['content']}"
+        async with semaphore:
+            try:
+                with self.metrics.span("summarize"):
+                    # 摘要失败可以用占位文本代替，不重试，整个调用不超过 summary_timeout，避免拖慢日记生成
+                    llm_response = await self._text_chat(summary_prompt, "summary", timeout=self.summary_timeout, retries=0)
+            except asyncio.TimeoutError:
+                logger.error(f"总结日记超时 (日期: {diary_date}, 超时: {self.summary_timeout} 秒)")
+                return ""
+            except Exception as e:
+                logger.error(f"总结日记时出错 (日期: {diary_date}): {e}")
+                return ""
+        if llm_response.role != "assistant":
+            logger.error(f"总结日记失败，LLM 响应无效 (日期: {diary_date})")
+            return ""
+        summary = f"[摘要 {diary_date}] {llm_response.completion_text}"
+        timeline.summary_cache[f"summary_{diary_date}"] = summary
+        logger.info(f"生成并缓存日记摘要: {diary_date}")
+        return summary
+
     async def terminate(self):
         logger.info("舔狗日记插件卸载中...")
+        await self.scheduler.stop()
+        tasks = list(self._tasks) + list(self._inflight.values()) + ([self._ready] if self._ready else [])
+        for task in tasks:
+            task.cancel()
+        await asyncio.gather(*tasks, return_exceptions=True)